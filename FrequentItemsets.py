@@ -0,0 +1,259 @@
+"""
+@author: Linh Vo
+@purpose: This program finds sets of products that are often bought by the same customers and
+writes the association rules between them, such as "people who bought A and B also bought C".
+Usage: python FrequentItemsets.py pdata --min-support 0.01 --min-confidence 0.3 --output rules.csv
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import sys
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+import PurchaseData
+import Recommendation
+
+# Largest number of products in a mined itemset
+MAX_ITEMSET_LENGTH = 4
+RULE_COLUMNS = ["ANTECEDENT", "CONSEQUENT", "SUPPORT", "CONFIDENCE", "LIFT"]
+
+# Association rule between two sets of product codes:
+# support - the share of customers who bought every product of the rule.
+# confidence - the share of customers who bought the antecedent that also bought the consequent.
+# lift - how many times more often the consequent is bought with the antecedent than in general.
+AssociationRule = namedtuple(
+    "AssociationRule", ["antecedent", "consequent", "support", "confidence", "lift"]
+)
+
+
+# Function to turn the purchases of every customer into merged transactions of frequent products
+def buildTransactions(peopleProductsMatrix, minSupportCount):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse CSR matrix with the purchase count of each product by each customer.
+    minSupportCount - a single integer, the least number of customers who bought a frequent product.
+    Returns a tuple consisting of:
+    A list of transactions, each a tuple of product ranks in increasing order.
+    A list with the number of customers who bought exactly each transaction.
+    An array mapping each rank to its product code, most bought product first.
+    """
+    # A customer counts once for a product, however many times they bought it
+    rows = np.repeat(
+        np.arange(peopleProductsMatrix.shape[0]), np.diff(peopleProductsMatrix.indptr)
+    )
+    bought = peopleProductsMatrix.data > 0
+    rows, productCodes = rows[bought], peopleProductsMatrix.indices[bought]
+    productSupport = np.bincount(productCodes, minlength=peopleProductsMatrix.shape[1])
+
+    # Rank frequent products from most to least bought, so transactions share long prefixes
+    frequentCodes = np.flatnonzero(productSupport >= minSupportCount)
+    rankedCodes = frequentCodes[
+        np.lexsort((frequentCodes, -productSupport[frequentCodes]))
+    ]
+    ranks = np.full(peopleProductsMatrix.shape[1], -1, dtype=np.int64)
+    ranks[rankedCodes] = np.arange(len(rankedCodes))
+    productRanks = ranks[productCodes]
+    frequent = productRanks >= 0
+    rows, productRanks = rows[frequent], productRanks[frequent]
+
+    # Sort the products of every customer by rank and merge identical transactions
+    order = np.lexsort((productRanks, rows))
+    rows, productRanks = rows[order], productRanks[order]
+    splitAt = np.flatnonzero(np.diff(rows)) + 1
+    transactions = defaultdict(int)
+    for transaction in np.split(productRanks, splitAt):
+        if len(transaction) > 0:
+            transactions[tuple(transaction.tolist())] += 1
+    return list(transactions), list(transactions.values()), rankedCodes
+
+
+# Function to grow frequent itemsets from the transactions ending with each product (FP-growth)
+def growItemsets(transactions, counts, suffix, minSupportCount, maxLength):
+    """
+    Parameters:
+    transactions - a list of tuples of product ranks in increasing order.
+    counts - a list with the number of customers behind each transaction.
+    suffix - a tuple of product ranks that every transaction was bought with.
+    minSupportCount - a single integer, the least number of customers who bought a frequent itemset.
+    maxLength - a single integer, the largest number of products in an itemset.
+    Yields tuples consisting of an itemset, as a tuple of product ranks, and its number of customers.
+    """
+    # Header table: total count and occurrences of every product in the transactions
+    support = defaultdict(int)
+    occurrences = defaultdict(list)
+    for transactionIndex, transaction in enumerate(transactions):
+        for position, rank in enumerate(transaction):
+            support[rank] += counts[transactionIndex]
+            occurrences[rank].append((transactionIndex, position))
+
+    # Least bought products first, each itemset is found from its least bought product
+    for rank in sorted(support, reverse=True):
+        if support[rank] < minSupportCount:
+            continue
+        itemset = (rank,) + suffix
+        yield itemset, support[rank]
+        if len(itemset) == maxLength:
+            continue
+
+        # Conditional pattern base: what was bought before this product in its transactions
+        prefixes = [
+            (transactions[transactionIndex][:position], counts[transactionIndex])
+            for transactionIndex, position in occurrences[rank]
+            if position > 0
+        ]
+        prefixSupport = defaultdict(int)
+        for prefix, count in prefixes:
+            for prefixRank in prefix:
+                prefixSupport[prefixRank] += count
+        conditional = defaultdict(int)
+        for prefix, count in prefixes:
+            kept = tuple(
+                prefixRank
+                for prefixRank in prefix
+                if prefixSupport[prefixRank] >= minSupportCount
+            )
+            if len(kept) > 0:
+                conditional[kept] += count
+        if len(conditional) > 0:
+            yield from growItemsets(
+                list(conditional),
+                list(conditional.values()),
+                itemset,
+                minSupportCount,
+                maxLength,
+            )
+
+
+# Function to find the sets of products bought by enough customers
+def findFrequentItemsets(
+    peopleProductsMatrix, minSupport, maxLength=MAX_ITEMSET_LENGTH
+):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse CSR matrix with the purchase count of each product by each customer.
+    minSupport - a float, the least share of customers who bought a frequent itemset.
+    maxLength - a single integer, the largest number of products in an itemset.
+    Returns a tuple consisting of a dictionary mapping each frequent itemset, as a frozenset
+    of product codes, to its number of customers, and the number of customers with a purchase.
+    """
+    transactionCount = int(np.count_nonzero(np.diff(peopleProductsMatrix.indptr)))
+    minSupportCount = max(int(np.ceil(minSupport * transactionCount)), 1)
+    transactions, counts, rankedCodes = buildTransactions(
+        peopleProductsMatrix, minSupportCount
+    )
+    itemsets = {
+        frozenset(rankedCodes[list(itemset)].tolist()): support
+        for itemset, support in growItemsets(
+            transactions, counts, (), minSupportCount, maxLength
+        )
+    }
+    return itemsets, transactionCount
+
+
+# Function to create the association rules of frequent itemsets
+def generateRules(itemsets, transactionCount, minConfidence):
+    """
+    Parameters:
+    itemsets - a dictionary mapping frequent itemsets to their number of customers, as returned by findFrequentItemsets.
+    transactionCount - a single integer, the number of customers with a purchase.
+    minConfidence - a float, the least confidence of a rule.
+    Yields AssociationRule tuples with sorted product codes, one at a time.
+    """
+    for itemset, support in itemsets.items():
+        if len(itemset) < 2:
+            continue
+        products = sorted(itemset)
+        for size in range(1, len(products)):
+            for antecedent in itertools.combinations(products, size):
+                # Every subset of a frequent itemset is frequent, so its count is known
+                confidence = support / itemsets[frozenset(antecedent)]
+                if confidence < minConfidence:
+                    continue
+                consequent = tuple(code for code in products if code not in antecedent)
+                yield AssociationRule(
+                    antecedent,
+                    consequent,
+                    support / transactionCount,
+                    confidence,
+                    confidence * transactionCount / itemsets[frozenset(consequent)],
+                )
+
+
+# Function to write association rules to a stream as they are generated
+def writeRules(rules, productIDs, outStream):
+    """
+    Parameters:
+    rules - an iterable of AssociationRule tuples.
+    productIDs - an Index of product IDs, the position of an ID is its product code.
+    outStream - a text stream to write the CSV rows to.
+    Returns the number of rules written.
+    """
+    writer = csv.writer(outStream)
+    writer.writerow(RULE_COLUMNS)
+    ruleCount = 0
+    for rule in rules:
+        # Product IDs of each side are joined with ";" to keep one row per rule
+        writer.writerow(
+            [
+                ";".join(PurchaseData.decodeIDs(productIDs, rule.antecedent)),
+                ";".join(PurchaseData.decodeIDs(productIDs, rule.consequent)),
+                f"{rule.support:.6f}",
+                f"{rule.confidence:.6f}",
+                f"{rule.lift:.6f}",
+            ]
+        )
+        ruleCount += 1
+    return ruleCount
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find products that are often bought together."
+    )
+    parser.add_argument("folder", help="folder with purchases.csv")
+    parser.add_argument(
+        "--min-support",
+        type=float,
+        default=0.01,
+        help="least share of customers who bought an itemset",
+    )
+    parser.add_argument(
+        "--min-confidence", type=float, default=0.3, help="least confidence of a rule"
+    )
+    parser.add_argument("--max-length", type=int, default=MAX_ITEMSET_LENGTH)
+    parser.add_argument("--output", default="-", help="output file (- for stdout)")
+    args = parser.parse_args()
+
+    # Summarize the purchases as a sparse customer x product matrix of encoded IDs
+    summary = PurchaseData.streamPurchaseSummary(
+        os.path.join(args.folder, "purchases.csv")
+    )
+    peopleProductsMatrix, _, _ = Recommendation.buildPeopleProductsMatrixFromCodes(
+        summary.encoding,
+        summary.userCodes,
+        summary.productCodes,
+        summary.purchaseCounts,
+    )
+    itemsets, transactionCount = findFrequentItemsets(
+        peopleProductsMatrix, args.min_support, args.max_length
+    )
+    rules = generateRules(itemsets, transactionCount, args.min_confidence)
+
+    if args.output == "-":
+        ruleCount = writeRules(rules, summary.encoding.productIDs, sys.stdout)
+    else:
+        with open(args.output, "w", newline="") as outStream:
+            ruleCount = writeRules(rules, summary.encoding.productIDs, outStream)
+    print(
+        f"{len(itemsets)} frequent itemsets and {ruleCount} rules "
+        f"from {transactionCount} customers.",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -6,15 +6,59 @@
 import numpy as np
 import pandas as pd
 import os
+import re
+from collections import namedtuple
 import matplotlib
 import matplotlib.pyplot as plt
 
+import PurchaseData
+
 AGE = "AGE"
 PURCHASE = "PURCHASE"
 PRODUCT_ID = "PRODUCT_ID"
 DESCRIPTION = "DESCRIPTION"
 TITLE = "Title"
 
+# Purchase revenue of every product by age group, worked out once:
+# purchase - a data frame with the total purchase of each product (rows) by age group (columns).
+# percentage - a data frame with the rounded percentage of each product's revenue per age group.
+AgeRevenueTable = namedtuple("AgeRevenueTable", ["purchase", "percentage"])
+
+# Posting lists of an inverted index:
+# keys - an Index of the indexed keys.
+# indptr - an array where the products of keys[i] are positions[indptr[i]:indptr[i + 1]].
+# positions - an int32 array of product row positions, increasing within each key.
+PostingList = namedtuple("PostingList", ["keys", "indptr", "positions"])
+
+# Search index of the product titles, built once by reformatProdData:
+# titles - a Series of the product titles, in product data frame order, with a default index.
+# tokens - a PostingList from each lowercase word of the titles to the products using it.
+# trigrams - a PostingList from each run of 3 lowercase characters, packed as an integer, to the products containing it.
+# Titles are lowercased after ASCII_CASE_FOLDS and padded with a space on both sides, so words at either end have trigrams like inner words.
+# trigramCounts - an array with the number of distinct trigrams of each title.
+SearchIndex = namedtuple(
+    "SearchIndex", ["titles", "tokens", "trigrams", "trigramCounts"]
+)
+
+# Characters with a special meaning in keywords, which are searched as regular expressions
+REGEX_CHARACTERS = set(".^$*+?{}[]\\|()")
+# Separator between titles when their characters are laid out in one array, never part of a title
+TITLE_SEPARATOR = "\x00"
+# Number of candidate titles few enough to check directly instead of narrowing them down further
+VERIFY_LIMIT = 32
+# Number of candidate titles above which they are checked with one str.contains call
+SCAN_LIMIT = 1000
+# Number of closest titles suggested when no title contains the keyword
+TOP_SUGGESTIONS = 10
+# Least share of the keyword trigrams a suggested title must contain
+MIN_SIMILARITY = 0.3
+# Non-ASCII characters that a case insensitive regular expression matches to an ASCII letter,
+# mapped to that letter so the index finds them the way a re.IGNORECASE search does
+ASCII_CASE_FOLDS = str.maketrans(
+    {"\u0130": "i", "\u0131": "i", "\u017f": "s", "\u212a": "k"}
+)
+
+
 # Function to set up full display of data frame
 def setupDisplay():
     """
@@ -32,33 +76,248 @@ def reformatProdData(productdf):
     """
     Parameters:
     productdf - a data frame storing the product data.
-    Returns no value.
+    Returns a SearchIndex of the product titles, for pickItemWithKeyword.
     """
 
     # Get product title from DESCRIPTION column
     productdf[TITLE] = (
         productdf[DESCRIPTION].str.split(pat="(", n=1).str.get(0).str.strip()
     )
+    return buildSearchIndex(productdf[TITLE])
+
+
+# Function to group product positions by key into posting lists
+def buildPostingList(keys, positions):
+    """
+    Parameters:
+    keys - an array with the key of every (key, product position) entry.
+    positions - an array with the product position of every entry, in increasing order.
+    Returns a PostingList with each product listed once per key.
+    """
+    keyCodes, uniqueKeys = pd.factorize(keys, sort=True)
+    # A stable sort by key keeps the positions of each key in increasing order
+    order = np.argsort(keyCodes, kind="stable")
+    keyCodes, positions = keyCodes[order], positions[order]
+    # Drop repeated (key, product) entries
+    first = np.ones(len(keyCodes), dtype=bool)
+    first[1:] = (keyCodes[1:] != keyCodes[:-1]) | (positions[1:] != positions[:-1])
+    keyCodes, positions = keyCodes[first], positions[first]
+    indptr = np.zeros(len(uniqueKeys) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keyCodes, minlength=len(uniqueKeys)), out=indptr[1:])
+    return PostingList(pd.Index(uniqueKeys), indptr, positions.astype(np.int32))
+
+
+# Function to get the products listed under some keys
+def findPostings(postingList, keys):
+    """
+    Parameters:
+    postingList - a PostingList.
+    keys - a list of keys.
+    Returns a list with the array of product positions of each key, None for keys that are not indexed.
+    """
+    found = postingList.keys.get_indexer(keys)
+    return [
+        (
+            postingList.positions[
+                postingList.indptr[code] : postingList.indptr[code + 1]
+            ]
+            if code >= 0
+            else None
+        )
+        for code in found
+    ]
+
+
+# Function to pack every run of 3 characters of a string into an integer
+def packTrigrams(text):
+    """
+    Parameters:
+    text - a string, possibly several titles joined by TITLE_SEPARATOR.
+    Returns a tuple consisting of an int64 array of packed trigrams and the array of their start offsets,
+    leaving out trigrams that contain TITLE_SEPARATOR.
+    """
+    # Unicode code points fit in 21 bits, so 3 of them fit in one int64
+    codePoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(
+        np.int64
+    )
+    if len(codePoints) < 3:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    packed = (codePoints[:-2] << 42) | (codePoints[1:-1] << 21) | codePoints[2:]
+    separator = codePoints == ord(TITLE_SEPARATOR)
+    valid = ~(separator[:-2] | separator[1:-1] | separator[2:])
+    return packed[valid], np.flatnonzero(valid)
+
+
+# Function to build the word and trigram search index of product titles
+def buildSearchIndex(titles):
+    """
+    Parameters:
+    titles - a Series of product titles.
+    Returns a SearchIndex, where product positions are row positions in titles.
+    """
+    lowerTitles = (
+        " " + titles.fillna("").str.translate(ASCII_CASE_FOLDS).str.lower() + " "
+    )
+
+    # Lay out all titles in one string so trigrams are found without a loop over products
+    titleLengths = lowerTitles.str.len().to_numpy()
+    trigrams, offsets = packTrigrams(
+        TITLE_SEPARATOR.join(lowerTitles) + TITLE_SEPARATOR
+    )
+    titleOfCharacter = np.repeat(np.arange(len(titleLengths)), titleLengths + 1)
+    trigramPostings = buildPostingList(trigrams, titleOfCharacter[offsets])
+
+    # Split titles into words
+    words = lowerTitles.str.findall(r"\w+").explode().dropna()
+
+    return SearchIndex(
+        titles.fillna("").reset_index(drop=True),
+        buildPostingList(
+            words.to_numpy(dtype=object), np.arange(len(titles))[words.index]
+        ),
+        trigramPostings,
+        np.bincount(trigramPostings.positions, minlength=len(titles)),
+    )
+
+
+# Function to find the products whose title contains a keyword
+def findMatchingProducts(searchIndex, keyword):
+    """
+    Parameters:
+    searchIndex - a SearchIndex built by reformatProdData.
+    keyword - a string to search for, case insensitive, as a regular expression if it uses REGEX_CHARACTERS.
+    Returns an array with the positions of the matched products, in product data frame order.
+    Only titles sharing the trigrams and inner words of the keyword are checked,
+    so the result is the same as scanning every title with a re.IGNORECASE search.
+    """
+    if (
+        not REGEX_CHARACTERS.isdisjoint(keyword)
+        or len(keyword) < 3
+        or not keyword.isascii()
+    ):
+        # Patterns, very short keywords and keywords with non-ASCII letters, whose
+        # case insensitive matches differ from lowercase text, need a scan of every title
+        matched = searchIndex.titles.str.contains(keyword, flags=re.IGNORECASE)
+        return np.flatnonzero(matched.to_numpy(dtype=bool))
+
+    lowerKeyword = keyword.lower()
+    # Words with a word on both sides in the keyword must be whole words of the title
+    innerWords = re.findall(r"\w+", lowerKeyword)[1:-1]
+    trigrams = pd.unique(packTrigrams(lowerKeyword)[0]).tolist()
+    postings = findPostings(searchIndex.tokens, innerWords) + findPostings(
+        searchIndex.trigrams, trigrams
+    )
+    if any(positions is None for positions in postings):
+        return np.zeros(0, dtype=np.int64)
+    # Start from the shortest list and drop candidates missing from the next ones
+    postings.sort(key=len)
+    candidates = postings[0]
+    for positions in postings[1:]:
+        if len(candidates) <= VERIFY_LIMIT:
+            break
+        found = np.searchsorted(positions, candidates)
+        found[found == len(positions)] = 0
+        candidates = candidates[positions[found] == candidates]
+
+    # Check the candidates with the same re.IGNORECASE rules on both paths, pandas string
+    # arrays fold case differently for case=False
+    candidateTitles = searchIndex.titles.iloc[candidates]
+    if len(candidates) > SCAN_LIMIT:
+        matched = candidateTitles.str.contains(keyword, flags=re.IGNORECASE).to_numpy(
+            dtype=bool
+        )
+    else:
+        pattern = re.compile(re.escape(keyword), re.IGNORECASE)
+        matched = np.array(
+            [pattern.search(title) is not None for title in candidateTitles.to_list()],
+            dtype=bool,
+        )
+    return candidates[matched].astype(np.int64)
+
+
+# Function to rank the products whose title is closest to a keyword
+def findSimilarProducts(
+    searchIndex, keyword, topN=TOP_SUGGESTIONS, minSimilarity=MIN_SIMILARITY
+):
+    """
+    Parameters:
+    searchIndex - a SearchIndex built by reformatProdData.
+    keyword - a string to search for, case insensitive, possibly misspelled.
+    topN - a single integer, the largest number of products returned.
+    minSimilarity - a float, the least share of the keyword trigrams a title must contain.
+    Returns a tuple consisting of an array with the positions of the closest products, best first,
+    and an array with their similarity, the share of the keyword trigrams found in their title.
+    Ties are ranked by shorter title first, then by product data frame order.
+    """
+    paddedKeyword = (
+        " " + " ".join(keyword.translate(ASCII_CASE_FOLDS).lower().split()) + " "
+    )
+    trigrams = pd.unique(packTrigrams(paddedKeyword)[0]).tolist()
+    postings = [
+        positions
+        for positions in findPostings(searchIndex.trigrams, trigrams)
+        if positions is not None
+    ]
+    if len(postings) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    # Count the keyword trigrams of every title, touching only the titles that have one
+    sharedCounts = np.bincount(
+        np.concatenate(postings), minlength=len(searchIndex.titles)
+    )
+    candidates = np.flatnonzero(sharedCounts >= minSimilarity * len(trigrams))
+    # More shared trigrams first, then fewer trigrams in the title, in one integer rank
+    rank = (
+        sharedCounts[candidates] * (int(searchIndex.trigramCounts.max()) + 1)
+        - searchIndex.trigramCounts[candidates]
+    )
+    if len(candidates) > topN:
+        # Only the candidates ranked at least as high as the topN-th one need sorting
+        lastRank = np.partition(rank, len(rank) - topN)[len(rank) - topN]
+        kept = rank >= lastRank
+        candidates, rank = candidates[kept], rank[kept]
+    order = np.lexsort((candidates, -rank))[:topN]
+    candidates = candidates[order]
+    return candidates, sharedCounts[candidates] / len(trigrams)
 
 
 # Function to handle item selection procedure
-def pickItemWithKeyword(keyword, productdf):
+def pickItemWithKeyword(keyword, productdf, searchIndex=None):
     """
     Parameters:
     keyword - a string representing the item keyword that user wants to search for
     productdf - a data frame storing the product data.
+    searchIndex - the SearchIndex returned by reformatProdData, or None to scan every title.
+    When no title contains the keyword, the closest titles of searchIndex are offered instead.
     Returns:
     selectedProductID - a string for selected product ID
     selectedProductName - a string for selected product title
     """
 
     # Filter product data frame to get only products that contain the keyword
-    matchProducts = productdf[productdf[TITLE].str.contains(keyword, case=False)][
-        [PRODUCT_ID, TITLE]
-    ]
+    if searchIndex is not None:
+        matchProducts = productdf.iloc[findMatchingProducts(searchIndex, keyword)][
+            [PRODUCT_ID, TITLE]
+        ]
+    else:
+        matchProducts = productdf[productdf[TITLE].str.contains(keyword, case=False)][
+            [PRODUCT_ID, TITLE]
+        ]
 
     matchCount = len(matchProducts)
 
+    # Suggest the closest titles when no title contains the keyword
+    suggested = False
+    if matchCount == 0 and searchIndex is not None:
+        similarPositions, similarity = findSimilarProducts(searchIndex, keyword)
+        matchProducts = productdf.iloc[similarPositions][[PRODUCT_ID, TITLE]].assign(
+            SIMILARITY=similarity.round(2)
+        )
+        matchCount = len(matchProducts)
+        suggested = matchCount > 0
+        if suggested:
+            print("\nThere are no items with", "'" + keyword + "'", "in the title.")
+
     # Change index to 1-based
     matchProducts.index = np.arange(1, matchCount + 1)
 
@@ -68,12 +327,26 @@ def pickItemWithKeyword(keyword, productdf):
     # If no match is found, return nothing and stop function
     if matchCount == 0:
         return None, None
-    # If there are multiple matched products, ask user to pick item
-    elif matchCount > 1:
-        print("\nWhich of the following items would you like to pick (enter number)\n")
+    # If there are multiple matched products or only suggestions, ask user to pick item
+    elif matchCount > 1 or suggested:
+        if suggested:
+            print("\nDid you mean one of the following items (enter number)\n")
+        else:
+            print(
+                "\nWhich of the following items would you like to pick (enter number)\n"
+            )
         print(matchProducts)
+        if suggested:
+            choice = input(
+                "\nEnter a number, or press enter or 0 to search for another keyword: "
+            ).strip()
+            # Declining the suggestions lets the user enter another keyword
+            if choice in ("", "0"):
+                return None, None
+        else:
+            choice = input("\nEnter a number: ")
         # Update item position to user input
-        selectedPosition = eval(input("\nEnter a number: "))
+        selectedPosition = eval(choice)
 
     selectedProductID = matchProducts.loc[selectedPosition][PRODUCT_ID]
     selectedProductName = matchProducts.loc[selectedPosition][TITLE]
@@ -83,26 +356,200 @@ def pickItemWithKeyword(keyword, productdf):
     return selectedProductID, selectedProductName
 
 
+# Function to calculate purchase revenue by age groups for all products at once
+def buildAgeRevenueTable(purchasedf):
+    """
+    Parameters:
+    purchasedf - a data frame storing the purchase data, a PurchaseData.PurchaseSummary,
+    or a PurchaseData.RevenueCube with PRODUCT_ID and AGE dimensions.
+    Returns an AgeRevenueTable with one row per product and one column per age group,
+    including the age groups with zero purchase, sorted by age group.
+    """
+    if isinstance(purchasedf, PurchaseData.PurchaseSummary):
+        purchase = pd.DataFrame(
+            purchasedf.productAgePurchase,
+            index=purchasedf.encoding.productIDs,
+            columns=pd.Index(purchasedf.ageGroups, name=AGE),
+        )
+    elif isinstance(purchasedf, PurchaseData.RevenueCube):
+        # Total the other dimensions of the cube away
+        purchase = cubeToFrame(rollUpCube(purchasedf, [PRODUCT_ID, AGE]))
+    else:
+        # Get all age groups in the data
+        ageGroup = list(set(purchasedf[AGE]))
+        # Total all purchases by product and age group in a single pass
+        purchase = (
+            purchasedf.groupby(by=[PRODUCT_ID, AGE], dropna=False, observed=True)[
+                PURCHASE
+            ]
+            .sum()
+            .unstack(AGE, fill_value=0)
+            .reindex(columns=ageGroup, fill_value=0)
+            .sort_index(axis=1)
+        )
+    # Percentage of each product's revenue contributed by each age group
+    productTotal = purchase.sum(axis=1)
+    percentage = (
+        purchase.div(productTotal.where(productTotal != 0), axis=0) * 100
+    ).round()
+    return AgeRevenueTable(purchase, percentage)
+
+
+# Function to total a revenue cube over the dimensions that are not kept
+def rollUpCube(cube, dimensions):
+    """
+    Parameters:
+    cube - a PurchaseData.RevenueCube.
+    dimensions - a list of the dimensions to keep, in the order wanted.
+    Returns a RevenueCube with only the kept dimensions, totalled over every value of the others.
+    """
+    axes = [cube.dimensions.index(dimension) for dimension in dimensions]
+    dropped = tuple(axis for axis in range(len(cube.dimensions)) if axis not in axes)
+    purchase = cube.purchase.sum(axis=dropped)
+    # Summing keeps the remaining axes in cube order, move them to the order asked for
+    remaining = sorted(axes)
+    purchase = purchase.transpose([remaining.index(axis) for axis in axes])
+    return PurchaseData.RevenueCube(
+        list(dimensions), [cube.labels[axis] for axis in axes], purchase, cube.rowCount
+    )
+
+
+# Function to select some values of the dimensions of a revenue cube
+def sliceCube(cube, selection):
+    """
+    Parameters:
+    cube - a PurchaseData.RevenueCube.
+    selection - a dictionary mapping dimensions to a single value, which removes the dimension,
+    or to a list of values, which keeps the dimension with only those values.
+    Returns a RevenueCube with the selected cells.
+    Raises KeyError if a selected value is not in the cube.
+    """
+    unknown = [dimension for dimension in selection if dimension not in cube.dimensions]
+    if unknown:
+        raise KeyError(f"the cube has no dimension {unknown}")
+    dimensions, labels = list(cube.dimensions), list(cube.labels)
+    purchase = cube.purchase
+    # Go from the last axis so the axis numbers left to do are not shifted
+    for axis in reversed(range(len(cube.dimensions))):
+        dimension = cube.dimensions[axis]
+        if dimension not in selection:
+            continue
+        values = selection[dimension]
+        if isinstance(values, (list, tuple, np.ndarray, pd.Index)):
+            codes = labels[axis].get_indexer(values)
+            if (codes < 0).any():
+                unknown = [value for value, code in zip(values, codes) if code < 0]
+                raise KeyError(f"{dimension} has no value {unknown}")
+            labels[axis] = labels[axis][codes]
+        else:
+            codes = labels[axis].get_loc(values)
+            del dimensions[axis], labels[axis]
+        purchase = purchase.take(codes, axis=axis)
+    return PurchaseData.RevenueCube(dimensions, labels, purchase, cube.rowCount)
+
+
+# Function to turn a revenue cube of one or two dimensions into a Series or data frame
+def cubeToFrame(cube):
+    """
+    Parameters:
+    cube - a PurchaseData.RevenueCube with one or two dimensions.
+    Returns a Series named PURCHASE for one dimension, or a data frame with the first dimension
+    as rows and the second as columns.
+    """
+    index = cube.labels[0].rename(cube.dimensions[0])
+    if len(cube.dimensions) == 1:
+        return pd.Series(cube.purchase, index=index, name=PURCHASE)
+    return pd.DataFrame(
+        cube.purchase, index=index, columns=cube.labels[1].rename(cube.dimensions[1])
+    )
+
+
+# Function to calculate purchase percentage of a product by the values of any customer dimension
+def calculatePurchaseByDimension(
+    selectedProductID, cube, dimension=AGE, selection=None
+):
+    """
+    Parameters:
+    selectedProductID - a string for selected product ID, or None for all products.
+    cube - a PurchaseData.RevenueCube with a PRODUCT_ID dimension and the dimension asked for.
+    dimension - a string for the dimension to break the purchases down by.
+    selection - a dictionary of dimension values to keep, as taken by sliceCube, or None for all customers.
+    Returns:
+    purchaseBy - a Series showing total purchases for selected product by dimension values.
+    purchasePercentage - a data frame containing total purchases and percentage contributed by each value.
+    """
+    if selectedProductID is not None:
+        if selectedProductID in cube.labels[cube.dimensions.index(PRODUCT_ID)]:
+            cube = sliceCube(cube, {PRODUCT_ID: selectedProductID})
+        else:
+            # Products without purchases get zeros for every value
+            cube = sliceCube(cube, {PRODUCT_ID: []})
+    if selection:
+        cube = sliceCube(cube, selection)
+    purchaseBy = cubeToFrame(rollUpCube(cube, [dimension]))
+
+    purchasePercentage = pd.DataFrame(data=purchaseBy)
+    # Calculate percentage of all purchases of the selected product each value contributed
+    purchasePercentage["PERCENTAGE"] = (
+        purchasePercentage[PURCHASE] / (purchasePercentage[PURCHASE].sum()) * 100
+    ).round()
+
+    return purchaseBy, purchasePercentage
+
+
 # Function to calculate purchase percentage by age groups
 def calculatePurchaseByAge(selectedProductID, purchasedf):
     """
     Parameters:
     selectedProductID - a string for selected product ID
-    purchasedf - a data frame storing the purchase data.
+    purchasedf - a data frame storing the purchase data, a PurchaseData.PurchaseSummary,
+    a PurchaseData.RevenueCube or an AgeRevenueTable.
     Returns:
     purchaseByAge - a Series showing total purchases for selected product by age groups.
     purchasePercentage - a data frame containing total purchases and percentage contributed by age groups.
     """
 
-    # Get all age groups in the data
-    ageGroup = list(set(purchasedf[AGE]))
-
-    # Calculate the total of all purchases of the selected product by age groups
-    purchaseByAge = (
-        purchasedf[purchasedf[PRODUCT_ID] == selectedProductID]
-        .groupby(by=AGE, dropna=False)[PURCHASE]
-        .sum()
-    )
+    if isinstance(purchasedf, AgeRevenueTable):
+        # Take the totals and percentages of the selected product from its row of the table
+        if selectedProductID in purchasedf.purchase.index:
+            purchaseByAge = purchasedf.purchase.loc[selectedProductID]
+            percentage = purchasedf.percentage.loc[selectedProductID]
+        else:
+            purchaseByAge = pd.Series(0, index=purchasedf.purchase.columns)
+            percentage = pd.Series(np.nan, index=purchasedf.purchase.columns)
+        purchaseByAge = purchaseByAge.rename(PURCHASE)
+        purchasePercentage = pd.DataFrame(
+            {PURCHASE: purchaseByAge, "PERCENTAGE": percentage}
+        )
+        return purchaseByAge, purchasePercentage
+
+    if isinstance(purchasedf, PurchaseData.RevenueCube):
+        return calculatePurchaseByDimension(selectedProductID, purchasedf, AGE)
+
+    if isinstance(purchasedf, PurchaseData.PurchaseSummary):
+        # Get all age groups in the data
+        ageGroup = list(purchasedf.ageGroups)
+        # Take the totals of the selected product from its row of the summary
+        productCode = PurchaseData.encodeIDs(
+            purchasedf.encoding.productIDs, [selectedProductID]
+        )[0]
+        if productCode >= 0:
+            totals = purchasedf.productAgePurchase[productCode]
+        else:
+            totals = np.zeros(len(ageGroup), dtype=purchasedf.productAgePurchase.dtype)
+        purchaseByAge = pd.Series(
+            totals, index=pd.Index(purchasedf.ageGroups, name=AGE), name=PURCHASE
+        )
+    else:
+        # Get all age groups in the data
+        ageGroup = list(set(purchasedf[AGE]))
+
+        # Calculate the total of all purchases of the selected product by age groups
+        purchaseByAge = (
+            purchasedf[purchasedf[PRODUCT_ID] == selectedProductID]
+            .groupby(by=AGE, dropna=False)[PURCHASE]
+            .sum()
+        )
     # Display all age groups including the ones with zero purchase and sort based on age groups
     purchaseByAge = purchaseByAge.reindex(ageGroup).fillna(0).sort_index()
 
@@ -116,38 +563,50 @@ def calculatePurchaseByAge(selectedProductID, purchasedf):
     return purchaseByAge, purchasePercentage
 
 
-# Function to plot bar chart
-def plot(purchasePercentage, selectedProductName):
+# Function to draw the bar chart on a set of axes
+def drawChart(axes, purchasePercentage, selectedProductName):
     """
     Parameters:
+    axes - the matplotlib Axes to draw on, cleared by the caller when reused.
     purchasePercentage - a data frame containing total purchases and percentage contributed by age groups.
     selectedProductName - a string for selected product title
     Returns no value
     """
 
-    # Set figure size
-    plt.figure(figsize=(8, 7))
-    chart = plt.bar(
+    chart = axes.bar(
         purchasePercentage.index,
         purchasePercentage.PERCENTAGE,
         color="green",
         align="edge",
     )
-    locs, labels = plt.xticks()
-    plt.setp(labels, rotation=30)  # Rotate x axis labels
-    plt.xticks(ha="left")  # Align label to the left
-    plt.title(
+    # Rotate x axis labels and align them to the left
+    plt.setp(axes.get_xticklabels(), rotation=30, ha="left")
+    axes.set_title(
         "Percentage of purchase revenue per age group for\n" + selectedProductName
     )
-    plt.ylabel("% of total revenue")
-    plt.xlabel("Age group")
+    axes.set_ylabel("% of total revenue")
+    axes.set_xlabel("Age group")
     # Display percentage value labels on top of each bar
     for bar in chart.patches:
-        plt.annotate(
+        axes.annotate(
             text=bar.get_height().astype(str) + "%",
             xy=(bar.get_x(), bar.get_height() + 0.8),
             ha="left",
         )
+
+
+# Function to plot bar chart
+def plot(purchasePercentage, selectedProductName):
+    """
+    Parameters:
+    purchasePercentage - a data frame containing total purchases and percentage contributed by age groups.
+    selectedProductName - a string for selected product title
+    Returns no value
+    """
+
+    # Set figure size
+    plt.figure(figsize=(8, 7))
+    drawChart(plt.gca(), purchasePercentage, selectedProductName)
     plt.savefig("plot.jpg")  # Save figure
 
 
@@ -158,15 +617,24 @@ def main():
 
     # Get folder name and import data files
     folderName = input("Please enter the name of the subfolder with the data file: ")
-    purchasedf = pd.read_csv(os.path.join(os.getcwd(), folderName, "purchases.csv"))
-    productdf = pd.read_csv(os.path.join(os.getcwd(), folderName, "prod.csv"))
+    # Stream the purchases so only the totals per product and age group are kept in memory
+    purchaseSummary = PurchaseData.streamPurchaseSummary(
+        os.path.join(os.getcwd(), folderName, "purchases.csv"), upperProductIDs=False
+    )
+    productdf = PurchaseData.readDataFile(
+        os.path.join(os.getcwd(), folderName, "prod.csv")
+    )
+    # Work out the age group breakdown of every product once
+    revenueTable = buildAgeRevenueTable(purchaseSummary)
 
-    reformatProdData(productdf)
+    searchIndex = reformatProdData(productdf)
 
     # Get keyword to look for products
     keyword = input("\nEnter item keyword: ")
     # Find matched products and get selected product ID and title
-    selectedProductID, selectedProductName = pickItemWithKeyword(keyword, productdf)
+    selectedProductID, selectedProductName = pickItemWithKeyword(
+        keyword, productdf, searchIndex
+    )
 
     # Repeat process if no products match with keyword
     while not selectedProductID:
@@ -176,18 +644,22 @@ def main():
             "in the title. Please repeat.",
         )
         keyword = input("\nEnter item keyword: ")
-        selectedProductID, selectedProductName = pickItemWithKeyword(keyword, productdf)
+        selectedProductID, selectedProductName = pickItemWithKeyword(
+            keyword, productdf, searchIndex
+        )
 
     # Calculate purchases and percentages by age groups
     purchaseByAge, purchasePercentage = calculatePurchaseByAge(
-        selectedProductID, purchasedf
+        selectedProductID, revenueTable
     )
     # Print out total purchases by age groups
     print(purchaseByAge)
 
     # Plot bar chart based on purchase percentage
     plot(purchasePercentage, selectedProductName)
+    PurchaseData.reportPeakMemory()
     plt.show()
 
 
-main()
+if __name__ == "__main__":
+    main()
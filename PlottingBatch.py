@@ -0,0 +1,234 @@
+"""
+@author: Linh Vo
+@purpose: This program renders the purchase revenue per age group chart of many products at once,
+without a display, writing one image file per product.
+Usage: python PlottingBatch.py pdata --all --output-dir charts
+       python PlottingBatch.py pdata --products P00255842 P00124642 --workers 4
+       python PlottingBatch.py pdata --all --where GENDER=F --where CITY_CATEGORY=A,B
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+# Render to files only, no window is ever opened
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import Plotting
+import PurchaseData
+
+# Number of charts a worker renders per task
+CHARTS_PER_TASK = 50
+
+# Data shared by the charts of one worker process, set by setupWorker
+workerState = {}
+
+
+# Function to read the --where filters into a revenue cube selection
+def parseSelection(conditions):
+    """
+    Parameters:
+    conditions - a list of strings such as "GENDER=F", several values of a column being joined by ",".
+    Returns a dictionary mapping each column in PurchaseData.CUSTOMER_DIMENSIONS to the list of values to keep.
+    Raises ValueError for a malformed condition or an unknown column.
+    """
+    selection = {}
+    for condition in conditions:
+        dimension, separator, values = condition.partition("=")
+        dimension = dimension.strip().upper()
+        if separator == "" or dimension not in PurchaseData.CUSTOMER_DIMENSIONS:
+            raise ValueError(f"expected COLUMN=VALUE, got {condition!r}")
+        selection.setdefault(dimension, []).extend(
+            value.strip() for value in values.split(",")
+        )
+    return selection
+
+
+# Function to match the values of a selection to the labels of a revenue cube
+def matchSelection(cube, selection):
+    """
+    Parameters:
+    cube - a PurchaseData.RevenueCube.
+    selection - a dictionary mapping dimensions to lists of values as typed, returned by parseSelection.
+    Returns a dictionary mapping dimensions to lists of cube labels, for Plotting.sliceCube.
+    Raises KeyError if a value is not in the cube.
+    """
+    matched = {}
+    for dimension, values in selection.items():
+        # Numeric columns such as OCCUPATION have integer labels
+        labels = cube.labels[cube.dimensions.index(dimension)]
+        labelOf = {str(label): label for label in labels}
+        unknown = [value for value in values if value not in labelOf]
+        if unknown:
+            raise KeyError(f"{dimension} has no value {unknown}")
+        matched[dimension] = [labelOf[value] for value in values]
+    return matched
+
+
+# Function to prepare a worker process with the data and a reusable figure
+def setupWorker(revenueTable, outputFolder, imageFormat):
+    """
+    Parameters:
+    revenueTable - a Plotting.AgeRevenueTable with the breakdown of every product.
+    outputFolder - a string for the folder to write the images to.
+    imageFormat - a string for the image file extension, such as "jpg" or "png".
+    Returns no value.
+    """
+    figure = Figure(figsize=(8, 7))
+    FigureCanvasAgg(figure)
+    workerState.update(
+        revenueTable=revenueTable,
+        outputFolder=outputFolder,
+        imageFormat=imageFormat,
+        figure=figure,
+        axes=figure.add_subplot(),
+    )
+
+
+# Function to get the image path of a product
+def chartPath(outputFolder, productID, imageFormat):
+    """
+    Parameters:
+    outputFolder - a string for the folder to write the images to.
+    productID - a string for the product ID.
+    imageFormat - a string for the image file extension.
+    Returns a string for the image path, with characters unsafe in file names replaced by "_".
+    """
+    return os.path.join(
+        outputFolder, re.sub(r"[^\w.-]", "_", str(productID)) + "." + imageFormat
+    )
+
+
+# Function to render the charts of some products in a worker process
+def renderCharts(products):
+    """
+    Parameters:
+    products - a list of (product ID, product title) tuples.
+    Returns the number of charts written.
+    """
+    figure, axes = workerState["figure"], workerState["axes"]
+    for productID, productName in products:
+        _, purchasePercentage = Plotting.calculatePurchaseByAge(
+            productID, workerState["revenueTable"]
+        )
+        # Reuse the same figure, only the axes content is redrawn
+        axes.clear()
+        Plotting.drawChart(axes, purchasePercentage, productName)
+        figure.savefig(
+            chartPath(
+                workerState["outputFolder"], productID, workerState["imageFormat"]
+            )
+        )
+    return len(products)
+
+
+# Function to render the charts of many products with a process pool
+def renderAllCharts(revenueTable, products, outputFolder, imageFormat="jpg", workers=1):
+    """
+    Parameters:
+    revenueTable - a Plotting.AgeRevenueTable with the breakdown of every product.
+    products - a list of (product ID, product title) tuples.
+    outputFolder - a string for the folder to write the images to.
+    imageFormat - a string for the image file extension, such as "jpg" or "png".
+    workers - a single integer, the number of worker processes.
+    Returns the number of charts written.
+    """
+    os.makedirs(outputFolder, exist_ok=True)
+    tasks = [
+        products[start : start + CHARTS_PER_TASK]
+        for start in range(0, len(products), CHARTS_PER_TASK)
+    ]
+    setupArgs = (revenueTable, outputFolder, imageFormat)
+    if workers <= 1:
+        setupWorker(*setupArgs)
+        return sum(renderCharts(task) for task in tasks)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=setupWorker, initargs=setupArgs
+    ) as pool:
+        return sum(pool.map(renderCharts, tasks))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render age group revenue charts for many products."
+    )
+    parser.add_argument("folder", help="folder with prod.csv and purchases.csv")
+    parser.add_argument("--products", nargs="+", help="product IDs to render")
+    parser.add_argument(
+        "--all", action="store_true", help="render every product in prod.csv"
+    )
+    parser.add_argument("--output-dir", default="charts", help="folder for the images")
+    parser.add_argument("--format", choices=["jpg", "png", "svg", "pdf"], default="jpg")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--where",
+        action="append",
+        default=[],
+        help="only count customers with COLUMN=VALUE[,VALUE...], may be repeated",
+    )
+    args = parser.parse_args()
+    if not args.all and not args.products:
+        parser.error("give --products or --all")
+    try:
+        selection = parseSelection(args.where)
+    except ValueError as error:
+        parser.error(str(error))
+
+    purchasePath = os.path.join(args.folder, "purchases.csv")
+    if selection:
+        # Stream the purchases into a cube of products, age groups and the filtered columns
+        cube = PurchaseData.streamRevenueCube(
+            purchasePath,
+            [Plotting.PRODUCT_ID, Plotting.AGE]
+            + [dimension for dimension in selection if dimension != Plotting.AGE],
+            upperProductIDs=False,
+        )
+        try:
+            cube = Plotting.sliceCube(cube, matchSelection(cube, selection))
+        except KeyError as error:
+            parser.error(error.args[0])
+        revenueTable = Plotting.buildAgeRevenueTable(cube)
+    else:
+        # Stream the purchases so only the totals per product and age group are kept in memory
+        purchaseSummary = PurchaseData.streamPurchaseSummary(
+            purchasePath, upperProductIDs=False
+        )
+        revenueTable = Plotting.buildAgeRevenueTable(purchaseSummary)
+    productdf = PurchaseData.readDataFile(os.path.join(args.folder, "prod.csv"))
+    Plotting.reformatProdData(productdf)
+
+    titles = dict(zip(productdf[Plotting.PRODUCT_ID], productdf[Plotting.TITLE]))
+    productIDs = list(titles) if args.all else args.products
+    unknown = [productID for productID in productIDs if productID not in titles]
+    if unknown:
+        print("Skipping unknown products:", " ".join(unknown), file=sys.stderr)
+    # Name the customers counted in the chart titles
+    segment = ", ".join(
+        dimension + "=" + ",".join(values) for dimension, values in selection.items()
+    )
+    products = [
+        (productID, titles[productID] + (f" ({segment})" if segment else ""))
+        for productID in productIDs
+        if productID in titles
+    ]
+
+    startTime = time.perf_counter()
+    chartCount = renderAllCharts(
+        revenueTable, products, args.output_dir, args.format, args.workers
+    )
+    runTime = time.perf_counter() - startTime
+    print(
+        f"Rendered {chartCount} charts to {args.output_dir} in {runTime:.2f}s "
+        f"with {args.workers} workers ({chartCount / max(runTime, 1e-9):.1f} charts/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
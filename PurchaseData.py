@@ -0,0 +1,540 @@
+"""
+@author: Linh Vo
+@purpose: This module loads the purchase data shared by Recommendation.py and Plotting.py.
+Large purchase files are read in chunks and summarized on the fly so memory stays bounded.
+User and product IDs are encoded once as dense integer codes so aggregation and matrix
+indexing work on integers, and the IDs are only looked up again for display.
+"""
+
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Peak memory is read with the Unix resource module, it is not reported on other systems
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Parquet snapshots need pyarrow, pickled data frames are used without it
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+USER_ID = "USER_ID"
+PRODUCT_ID = "PRODUCT_ID"
+AGE = "AGE"
+PURCHASE = "PURCHASE"
+# Optional purchase time column, used by the windowed co-purchasing model
+TIMESTAMP = "TIMESTAMP"
+# Customer columns a revenue cube can be broken down by
+CUSTOMER_DIMENSIONS = [
+    "GENDER",
+    AGE,
+    "OCCUPATION",
+    "CITY_CATEGORY",
+    "STAY_IN_CURRENT_CITY_YEARS",
+    "MARITAL_STATUS",
+]
+
+# Narrow types used for the columns of purchase snapshots, USER_ID is decided from the data
+PURCHASE_DTYPES = {
+    PRODUCT_ID: "category",
+    "GENDER": "category",
+    AGE: "category",
+    "OCCUPATION": "Int8",
+    "CITY_CATEGORY": "category",
+    "STAY_IN_CURRENT_CITY_YEARS": "category",
+    "MARITAL_STATUS": "Int8",
+    PURCHASE: "Int32",
+}
+
+# Number of purchase rows read at a time
+CHUNK_SIZE = 500000
+# Number of partial summaries collected before they are merged
+MERGE_EVERY = 16
+
+# Dense integer codes of the IDs: the code of an ID is its position in the sorted Index
+IDEncoding = namedtuple("IDEncoding", ["userIDs", "productIDs"])
+
+# Running aggregates of a purchase file:
+# encoding - the IDEncoding of all users and products in the file.
+# userCodes, productCodes - int32 arrays with one entry per distinct (user, product) pair.
+# purchaseCounts - an int64 array with the number of purchases of each pair.
+# ageGroups - a sorted Index of the age groups, missing age last if present.
+# productAgePurchase - an array with the total purchase amount per product code (rows) and age group (columns).
+# rowCount - the number of purchase rows read.
+PurchaseSummary = namedtuple(
+    "PurchaseSummary",
+    [
+        "encoding",
+        "userCodes",
+        "productCodes",
+        "purchaseCounts",
+        "ageGroups",
+        "productAgePurchase",
+        "rowCount",
+    ],
+)
+
+# Total purchase amount broken down by several columns at once:
+# dimensions - a list of the column names, one per axis of purchase.
+# labels - a list with the sorted Index of the values of each dimension, missing value last if present.
+# purchase - a dense array with the total purchase amount of every combination of dimension values.
+# rowCount - the number of purchase rows read.
+RevenueCube = namedtuple(
+    "RevenueCube", ["dimensions", "labels", "purchase", "rowCount"]
+)
+
+
+# Function to encode IDs as integer codes
+def encodeIDs(ids, values):
+    """
+    Parameters:
+    ids - an Index of known IDs, as stored in an IDEncoding.
+    values - a list or array of IDs to encode.
+    Returns an int32 array of codes, -1 for IDs that are not known.
+    """
+    return ids.get_indexer(values).astype(np.int32)
+
+
+# Function to look up the IDs of integer codes
+def decodeIDs(ids, codes):
+    """
+    Parameters:
+    ids - an Index of known IDs, as stored in an IDEncoding.
+    codes - an array of integer codes.
+    Returns a list of IDs.
+    """
+    return ids[np.asarray(codes)].to_list()
+
+
+# Function to encode the IDs of a purchase data frame
+def encodePurchaseData(purchasedf):
+    """
+    Parameters:
+    purchasedf - a data frame storing the purchasing data.
+    Returns a tuple consisting of the IDEncoding, the int32 user codes and the int32 product codes
+    of every row (-1 where the ID is missing).
+    """
+    userCodes, userIDs = pd.factorize(purchasedf[USER_ID], sort=True)
+    productCodes, productIDs = pd.factorize(purchasedf[PRODUCT_ID], sort=True)
+    return (
+        IDEncoding(pd.Index(userIDs), pd.Index(productIDs)),
+        userCodes.astype(np.int32),
+        productCodes.astype(np.int32),
+    )
+
+
+# Function to encode values while growing the list of known IDs
+def extendIDs(ids, values, keepMissing=False):
+    """
+    Parameters:
+    ids - an Index of the IDs seen so far, in order of appearance.
+    values - an array of IDs to encode.
+    keepMissing - a boolean, True to give missing values their own code instead of -1.
+    Returns a tuple consisting of the extended Index and the int32 codes of values.
+    """
+    codes = ids.get_indexer(values)
+    unseen = codes < 0
+    if not keepMissing:
+        unseen &= pd.notna(values)
+    if unseen.any():
+        ids = ids.append(pd.Index(pd.unique(values[unseen])))
+        codes[unseen] = ids.get_indexer(values[unseen])
+    return ids, codes.astype(np.int32)
+
+
+# Function to sort IDs encoded in order of appearance
+def sortIDs(ids):
+    """
+    Parameters:
+    ids - an Index of IDs in order of appearance.
+    Returns a tuple consisting of the sorted Index and an array mapping each old code to its new code.
+    """
+    sortedIDs = ids.sort_values()
+    return sortedIDs, sortedIDs.get_indexer(ids).astype(np.int32)
+
+
+# Function to convert IDs read as strings back to integers when they all are
+def restoreIntegerIDs(ids):
+    """
+    Parameters:
+    ids - an Index of IDs, strings when they were read from purchases.csv.
+    Returns an Index of int64 IDs when every ID is a distinct integer, otherwise ids unchanged.
+    """
+    if (
+        not pd.api.types.is_string_dtype(ids)
+        or not ids.str.fullmatch(r"[+-]?\d+").all()
+    ):
+        return ids
+    try:
+        integerIDs = ids.astype(np.int64)
+    except OverflowError:
+        return ids
+    # IDs such as "01" and "1" stay strings, as integers they would be the same customer
+    return integerIDs if integerIDs.is_unique else ids
+
+
+# Function to merge partial pair counts into one
+def mergePairCounts(keyPartials, countPartials):
+    """
+    Parameters:
+    keyPartials - a list of int64 arrays of (user, product) pair keys.
+    countPartials - a list of count arrays matching keyPartials.
+    Returns a tuple consisting of the sorted distinct keys and their added up counts.
+    """
+    keys, inverse = np.unique(np.concatenate(keyPartials), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate(countPartials))
+    return keys, counts.astype(np.int64)
+
+
+# Function to get the snapshot path of a CSV data file
+def snapshotPath(csvPath):
+    """
+    Parameters:
+    csvPath - a string for the path of a CSV data file.
+    Returns a string for the path of its columnar snapshot.
+    """
+    suffix = ".parquet" if pa is not None else ".pkl"
+    return os.path.splitext(csvPath)[0] + suffix
+
+
+# Function to check whether a CSV data file has an up to date snapshot
+def hasFreshSnapshot(csvPath):
+    """
+    Parameters:
+    csvPath - a string for the path of a CSV data file.
+    Returns True if the snapshot exists and is newer than the CSV file.
+    """
+    snapshot = snapshotPath(csvPath)
+    return os.path.exists(snapshot) and os.path.getmtime(snapshot) >= os.path.getmtime(
+        csvPath
+    )
+
+
+# Function to convert purchases.csv into a typed columnar snapshot
+def writePurchaseSnapshot(purchasePath, chunkSize=CHUNK_SIZE):
+    """
+    Parameters:
+    purchasePath - a string for the path of purchases.csv.
+    chunkSize - a single integer, the number of rows converted at a time.
+    Returns a string for the path of the snapshot written.
+    Text columns become categoricals and small numbers narrow integers.
+    """
+    snapshot = snapshotPath(purchasePath)
+    tempSnapshot = snapshot + ".tmp"
+    # Keep user IDs as integers only if every chunk has numeric IDs, all chunks share the type
+    integerUsers = all(
+        pd.api.types.is_integer_dtype(userChunk[USER_ID])
+        for userChunk in pd.read_csv(
+            purchasePath, usecols=[USER_ID], chunksize=chunkSize
+        )
+    )
+    chunks = pd.read_csv(purchasePath, dtype=PURCHASE_DTYPES, chunksize=chunkSize)
+    writer = None
+    frames = []
+    for chunk in chunks:
+        if integerUsers:
+            chunk[USER_ID] = chunk[USER_ID].astype("int64")
+        else:
+            # Other IDs become categoricals of strings, numeric looking ones included
+            chunk[USER_ID] = chunk[USER_ID].astype("string").astype("category")
+        if pa is None:
+            frames.append(chunk)
+            continue
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            # Categories differ between chunks, so give every chunk the same dictionary layout
+            schema = pa.schema(
+                [
+                    (
+                        field.with_type(
+                            pa.dictionary(pa.int32(), field.type.value_type)
+                        )
+                        if pa.types.is_dictionary(field.type)
+                        else field
+                    )
+                    for field in table.schema
+                ],
+                metadata=table.schema.metadata,
+            )
+            writer = pq.ParquetWriter(tempSnapshot, schema)
+        writer.write_table(table.cast(schema))
+
+    if pa is None:
+        purchasedf = pd.concat(frames, ignore_index=True)
+        # Categories of the chunks are merged back into one categorical per column
+        for column in purchasedf.columns:
+            if frames[0][column].dtype == "category":
+                purchasedf[column] = purchasedf[column].astype("category")
+        purchasedf.to_pickle(tempSnapshot)
+    elif writer is not None:
+        writer.close()
+    os.replace(tempSnapshot, snapshot)
+    return snapshot
+
+
+# Function to convert prod.csv into a columnar snapshot
+def writeProductSnapshot(productPath):
+    """
+    Parameters:
+    productPath - a string for the path of prod.csv.
+    Returns a string for the path of the snapshot written.
+    """
+    snapshot = snapshotPath(productPath)
+    productdf = pd.read_csv(productPath)
+    if pa is not None:
+        productdf.to_parquet(snapshot + ".tmp", index=False)
+    else:
+        productdf.to_pickle(snapshot + ".tmp")
+    os.replace(snapshot + ".tmp", snapshot)
+    return snapshot
+
+
+# Function to read a data file from its snapshot when it is up to date
+def readDataFile(csvPath, columns=None):
+    """
+    Parameters:
+    csvPath - a string for the path of a CSV data file.
+    columns - a list of column names to read, None for all columns.
+    Returns a data frame with the file content.
+    """
+    if not hasFreshSnapshot(csvPath):
+        return pd.read_csv(csvPath, usecols=columns)
+    if pa is not None:
+        return pd.read_parquet(snapshotPath(csvPath), columns=columns)
+    datadf = pd.read_pickle(snapshotPath(csvPath))
+    return datadf if columns is None else datadf[columns]
+
+
+# Function to read purchase rows chunk by chunk
+def readPurchaseChunks(purchasePath, columns, chunkSize=CHUNK_SIZE):
+    """
+    Parameters:
+    purchasePath - a string for the path of purchases.csv.
+    columns - a list of column names to read.
+    chunkSize - a single integer, the number of rows per chunk.
+    Yields data frames of at most chunkSize rows, read from the snapshot when it is up to date.
+    """
+    if not hasFreshSnapshot(purchasePath):
+        # Fixed column types keep values comparable across chunks, otherwise a short chunk
+        # without "4+" reads STAY_IN_CURRENT_CITY_YEARS as integers and the others as strings
+        columnTypes = {
+            column: PURCHASE_DTYPES[column]
+            for column in columns
+            if column in PURCHASE_DTYPES
+        }
+        # User IDs are strings in every chunk, a chunk of numeric IDs would otherwise
+        # read 1 where another chunk with alphanumeric IDs reads "1"
+        if USER_ID in columns:
+            columnTypes[USER_ID] = str
+        yield from pd.read_csv(
+            purchasePath, usecols=columns, dtype=columnTypes, chunksize=chunkSize
+        )
+    elif pa is not None:
+        parquetFile = pq.ParquetFile(snapshotPath(purchasePath))
+        for batch in parquetFile.iter_batches(batch_size=chunkSize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        purchasedf = pd.read_pickle(snapshotPath(purchasePath))[columns]
+        for start in range(0, len(purchasedf), chunkSize):
+            yield purchasedf.iloc[start : start + chunkSize].copy()
+
+
+# Function to read purchases.csv chunk by chunk and keep running aggregates
+def streamPurchaseSummary(purchasePath, upperProductIDs=True, chunkSize=CHUNK_SIZE):
+    """
+    Parameters:
+    purchasePath - a string for the path of purchases.csv.
+    upperProductIDs - a boolean, True to convert product IDs to uppercase for consistency.
+    chunkSize - a single integer, the number of rows read at a time.
+    Returns a PurchaseSummary.
+    Only one chunk of raw rows is held in memory at a time, plus the aggregates.
+    """
+    userIDs = pd.Index([])
+    productIDs = pd.Index([])
+    ageGroups = pd.Index([])
+    keyPartials, countPartials = [np.zeros(0, np.int64)], [np.zeros(0, np.int64)]
+    ageTotals = np.zeros((0, 0))
+    integralPurchase = True
+    rowCount = 0
+
+    chunks = readPurchaseChunks(
+        purchasePath, [USER_ID, PRODUCT_ID, AGE, PURCHASE], chunkSize
+    )
+    for chunk in chunks:
+        rowCount += len(chunk)
+        if upperProductIDs:
+            chunk[PRODUCT_ID] = chunk[PRODUCT_ID].str.upper()
+        # Encode the IDs of the chunk, new IDs get the next free codes
+        userIDs, userCodes = extendIDs(userIDs, chunk[USER_ID].to_numpy())
+        productIDs, productCodes = extendIDs(productIDs, chunk[PRODUCT_ID].to_numpy())
+        ageGroups, ageCodes = extendIDs(
+            ageGroups, chunk[AGE].to_numpy(), keepMissing=True
+        )
+        purchase = chunk[PURCHASE]
+        integralPurchase &= pd.api.types.is_integer_dtype(purchase)
+
+        # Count rows with a purchase value, the same way groupby().count() does
+        counted = (userCodes >= 0) & (productCodes >= 0) & purchase.notna().to_numpy()
+        keys = (userCodes[counted].astype(np.int64) << 32) | productCodes[counted]
+        chunkKeys, chunkCounts = np.unique(keys, return_counts=True)
+        keyPartials.append(chunkKeys)
+        countPartials.append(chunkCounts)
+        # Merge regularly so the number of partial counts stays small
+        if len(keyPartials) > MERGE_EVERY:
+            keys, counts = mergePairCounts(keyPartials, countPartials)
+            keyPartials, countPartials = [keys], [counts]
+
+        # Add the purchase amounts to the product x age group totals
+        productCount, ageCount = len(productIDs), len(ageGroups)
+        ageTotals = np.pad(
+            ageTotals,
+            (
+                (0, productCount - ageTotals.shape[0]),
+                (0, ageCount - ageTotals.shape[1]),
+            ),
+        )
+        known = productCodes >= 0
+        ageTotals += np.bincount(
+            productCodes[known].astype(np.int64) * ageCount + ageCodes[known],
+            weights=purchase.fillna(0).to_numpy(dtype=np.float64)[known],
+            minlength=productCount * ageCount,
+        ).reshape(productCount, ageCount)
+
+    # Give the IDs the codes of their sorted order, numeric user IDs sort as numbers
+    userIDs, userRemap = sortIDs(restoreIntegerIDs(userIDs))
+    productIDs, productRemap = sortIDs(productIDs)
+    ageGroups, ageRemap = sortIDs(ageGroups)
+    keys, counts = mergePairCounts(keyPartials, countPartials)
+    userCodes = userRemap[keys >> 32]
+    productCodes = productRemap[keys & 0xFFFFFFFF]
+    productAgePurchase = np.zeros_like(ageTotals)
+    productAgePurchase[np.ix_(productRemap, ageRemap)] = ageTotals
+    if integralPurchase:
+        productAgePurchase = productAgePurchase.astype(np.int64)
+
+    return PurchaseSummary(
+        IDEncoding(userIDs, productIDs),
+        userCodes,
+        productCodes,
+        counts,
+        ageGroups,
+        productAgePurchase,
+        rowCount,
+    )
+
+
+# Function to read purchases.csv chunk by chunk and total the purchase amount per combination of columns
+def streamRevenueCube(
+    purchasePath,
+    dimensions=CUSTOMER_DIMENSIONS,
+    upperProductIDs=True,
+    chunkSize=CHUNK_SIZE,
+):
+    """
+    Parameters:
+    purchasePath - a string for the path of purchases.csv.
+    dimensions - a list of column names to break the purchase down by, PRODUCT_ID included for a product axis.
+    upperProductIDs - a boolean, True to convert product IDs to uppercase for consistency.
+    chunkSize - a single integer, the number of rows read at a time.
+    Returns a RevenueCube with one axis per dimension, in the given order.
+    The cube has one cell per combination of values, so its size is the product of the numbers of values.
+    """
+    labels = [pd.Index([]) for _ in dimensions]
+    totals = np.zeros((0,) * len(dimensions))
+    integralPurchase = True
+    rowCount = 0
+
+    for chunk in readPurchaseChunks(purchasePath, dimensions + [PURCHASE], chunkSize):
+        rowCount += len(chunk)
+        if upperProductIDs and PRODUCT_ID in dimensions:
+            chunk[PRODUCT_ID] = chunk[PRODUCT_ID].str.upper()
+        # Encode the values of every dimension, new values get the next free codes
+        codes = []
+        for axis, dimension in enumerate(dimensions):
+            # Factorize the chunk first so only its distinct values are looked up
+            chunkCodes, chunkValues = pd.factorize(
+                chunk[dimension], use_na_sentinel=False
+            )
+            labels[axis], valueCodes = extendIDs(
+                labels[axis], chunkValues.to_numpy(), keepMissing=True
+            )
+            codes.append(valueCodes[chunkCodes])
+        purchase = chunk[PURCHASE]
+        integralPurchase &= pd.api.types.is_integer_dtype(purchase)
+
+        # Grow the cube to the values seen so far
+        shape = tuple(len(axisLabels) for axisLabels in labels)
+        if shape != totals.shape:
+            totals = np.pad(
+                totals,
+                [(0, size - current) for size, current in zip(shape, totals.shape)],
+            )
+        # Add the chunk to the cells it touches only, the cube can be much larger than a chunk
+        cells, inverse = np.unique(
+            np.ravel_multi_index(codes, shape), return_inverse=True
+        )
+        totals.reshape(-1)[cells] += np.bincount(
+            inverse, weights=purchase.fillna(0).to_numpy(dtype=np.float64)
+        )
+
+    # Give the values of every dimension the codes of their sorted order
+    cube = totals
+    for axis in range(len(dimensions)):
+        labels[axis], remap = sortIDs(labels[axis])
+        cube = cube.take(np.argsort(remap), axis=axis)
+    if integralPurchase:
+        cube = cube.astype(np.int64)
+    return RevenueCube(list(dimensions), labels, cube, rowCount)
+
+
+# Function to get the peak memory used by the program so far
+def peakMemoryMB():
+    """
+    Parameters: None
+    Returns a float for the peak resident set size of the process, in megabytes,
+    or None where the resource module is not available, such as on Windows.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+# Function to print the peak memory used by the program so far
+def reportPeakMemory(label="Peak memory"):
+    """
+    Parameters:
+    label - a string printed before the value.
+    Returns no value, nothing is printed when the peak memory is not available.
+    """
+    peak = peakMemoryMB()
+    if peak is not None:
+        print(f"[{label}: {peak:.1f} MB]")
+
+
+def main():
+    # Convert the data files of a folder once, later runs load the snapshots
+    folderName = input(
+        "Please enter the name of the folder with the data files to convert: "
+    )
+    for fileName, writeSnapshot in (
+        ("purchases.csv", writePurchaseSnapshot),
+        ("prod.csv", writeProductSnapshot),
+    ):
+        csvPath = os.path.join(os.getcwd(), folderName, fileName)
+        print("Wrote", writeSnapshot(csvPath))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,32 +5,345 @@
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 import os
+import shutil
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import PurchaseData
+
+# Number of best co-purchase partners kept for each product
+TOP_NEIGHBORS = 10
+# Ways of scoring product pairs, "count" is the raw number of co-purchases
+SCORING_MODES = ["count", "cosine", "jaccard", "lift", "pmi"]
+# Ways to combine the co-purchase rows of the products in a basket
+BASKET_AGGREGATES = ["sum", "max"]
+# Largest number of products accepted in a basket
+MAX_BASKET_SIZE = 50
+# Prefix of the model cache folders and cache layout version, bump it when the layout changes
+MODEL_CACHE_PREFIX = ".copurchase-model-"
+MODEL_CACHE_VERSION = "v2"
+# File of a model cache folder with the size and modification time of the purchase data it was built from
+SOURCE_STAMP_FILE = "sourceStamp.npy"
+
+# Compact co-purchase lookup: the neighbors of the product at position p are
+# neighbors[indptr[p]:indptr[p + 1]], ordered by decreasing score
+NeighborIndex = namedtuple(
+    "NeighborIndex", ["productIDs", "indptr", "neighbors", "scores"]
+)
+
+
+# Approximate co-purchase lookup for very large catalogs:
+# signatures - a products x hashes array of MinHash values of the customers who bought each product.
+# buyerCounts - an array with the number of customers who bought each product.
+# sortedSignatures - a hashes x bought products array, each row holding one hash's values in order,
+# sortedProducts - the matching product positions, so products sharing a value sit next to each other.
+MinHashIndex = namedtuple(
+    "MinHashIndex",
+    ["productIDs", "signatures", "buyerCounts", "sortedSignatures", "sortedProducts"],
+)
+
+# Number of popular products kept overall and for each category, ties included
+TOP_POPULAR = 5
+
+# Precomputed popularity ranking:
+# mostBought - a list of the product IDs bought more than any other, as findMostBought returns.
+# overall - a list of the top product IDs, best first, ties with the last one included.
+# byCategory - a dictionary mapping each category to its top product IDs, the same way.
+# productCategory - a dictionary mapping each product ID to its category.
+PopularityIndex = namedtuple(
+    "PopularityIndex", ["mostBought", "overall", "byCategory", "productCategory"]
+)
+
+# Product data prepared once for display, positions follow productIDs:
+# productIDs - an Index of product IDs, the position of an ID is its product code.
+# categories - an array of category names, used to sort the lines.
+# labels - an array of upper-cased category names.
+# details - an array of the text following the category, such as "-- DESCRIPTION, $PRICE".
+ProductIndex = namedtuple(
+    "ProductIndex", ["productIDs", "categories", "labels", "details"]
+)
+
+# Modulus of the MinHash hash functions, a prime that keeps hash values within int32
+MINHASH_PRIME = 2**31 - 1
+
+
+# Co-purchasing data kept in memory so it can be updated with new purchases
+class CoPurchaseModel:
+    """
+    Attributes:
+    userIDs - an Index of user IDs matching the rows of peopleProductsMatrix.
+    productIDs - an Index of product IDs matching the columns of peopleProductsMatrix.
+    peopleProductsMatrix - a sparse CSR matrix with the purchase count of each product by each customer.
+    coPurchase - a sparse CSR matrix with the co-purchase score of every product pair.
+    totalPurchase - an array with the total number of purchases of each product.
+    neighborIndex - a NeighborIndex with the best partners of each product under the scoring mode.
+    topK - a single integer, the number of neighbors kept for each product.
+    scoring - a string, one of SCORING_MODES, used to rank the neighbors.
+    """
+
+    def __init__(
+        self,
+        userIDs,
+        productIDs,
+        peopleProductsMatrix,
+        coPurchase,
+        totalPurchase,
+        neighborIndex,
+        topK=TOP_NEIGHBORS,
+        scoring="count",
+    ):
+        self.userIDs = pd.Index(userIDs)
+        self.productIDs = pd.Index(productIDs)
+        self.peopleProductsMatrix = peopleProductsMatrix
+        self.coPurchase = coPurchase
+        self.totalPurchase = totalPurchase
+        self.neighborIndex = neighborIndex
+        self.topK = topK
+        self.scoring = scoring
+
+
+# Co-purchasing model that only counts the purchases of a recent time window
+class WindowedCoPurchaseModel(CoPurchaseModel):
+    """
+    Attributes:
+    All attributes of CoPurchaseModel, computed from the purchases in the window only.
+    windowLength - a pandas Timedelta, how far back purchases are counted.
+    bucketLength - a pandas Timedelta, the time granularity of expiry.
+    buckets - a dictionary mapping each bucket number (time since 1970 // bucketLength)
+        to the user codes and product codes of its purchases.
+    currentTime - a pandas Timestamp, the end of the window, None before any purchase.
+    """
+
+    def __init__(
+        self,
+        userIDs,
+        productIDs,
+        peopleProductsMatrix,
+        coPurchase,
+        totalPurchase,
+        neighborIndex,
+        topK,
+        scoring,
+        windowLength,
+        bucketLength,
+    ):
+        super().__init__(
+            userIDs,
+            productIDs,
+            peopleProductsMatrix,
+            coPurchase,
+            totalPurchase,
+            neighborIndex,
+            topK,
+            scoring,
+        )
+        self.windowLength = windowLength
+        self.bucketLength = bucketLength
+        self.buckets = {}
+        self.currentTime = None
+
 
 # Function to create a purchase summary
-def fillPeopleProducts(purchasedf):
+def fillPeopleProducts(purchasedf, dense=False):
     """
     Parameters:
     purchasedf - a data frame storing the purchasing data.
+    dense - a boolean, True to get an ordinary data frame, only advisable for small data.
     Returns a new data frame summarizing which products were bought by which customer.
+    By default the data frame has sparse columns, so its memory grows with the number
+    of purchases instead of the number of customers times the number of products.
     """
-    # Create a new data frame with the purchase count for each user
-    purchaseSummary = pd.DataFrame(
-        purchasedf.groupby(["USER_ID", "PRODUCT_ID"]).count()["PURCHASE"]
-    )
-    # Format data frame to have users as rows and products as columns
-    peopleProducts = pd.pivot_table(
-        purchaseSummary,
-        values="PURCHASE",
-        index=["USER_ID"],
-        columns=["PRODUCT_ID"],
-        fill_value=0,
+    # Count the purchases of each user straight from the encoded IDs, without a pivot table
+    peopleProductsMatrix, userIDs, prodIDs = buildPeopleProductsMatrix(purchasedf)
+    peopleProducts = pd.DataFrame.sparse.from_spmatrix(
+        peopleProductsMatrix, index=userIDs, columns=prodIDs
     )
-    # Remove column and row labels strings from data frame
-    peopleProducts = peopleProducts.rename_axis(None).rename_axis(None, axis=1)
+    if dense:
+        peopleProducts = peopleProducts.sparse.to_dense()
     return peopleProducts
 
 
+# Function to create a sparse purchase summary
+def buildPeopleProductsMatrix(purchasedf):
+    """
+    Parameters:
+    purchasedf - a data frame storing the purchasing data.
+    Returns a tuple consisting of a sparse CSR matrix with the purchase count of each product (columns) by each customer (rows),
+    the sorted array of user IDs and the sorted array of product IDs.
+    """
+    # Encode user and product IDs as row and column positions
+    encoding, userCodes, prodCodes = PurchaseData.encodePurchaseData(purchasedf)
+    # Only count rows with a purchase value, the same way groupby().count() does
+    counted = (
+        (userCodes >= 0) & (prodCodes >= 0) & purchasedf["PURCHASE"].notna().to_numpy()
+    )
+    # Duplicate (user, product) entries are summed up into purchase counts
+    return buildPeopleProductsMatrixFromCodes(
+        encoding,
+        userCodes[counted],
+        prodCodes[counted],
+        np.ones(counted.sum(), dtype=np.int64),
+    )
+
+
+# Function to create a sparse purchase summary from encoded purchase counts
+def buildPeopleProductsMatrixFromCodes(encoding, userCodes, prodCodes, purchaseCounts):
+    """
+    Parameters:
+    encoding - a PurchaseData.IDEncoding of the users and products.
+    userCodes - an array of user codes.
+    prodCodes - an array of product codes matching userCodes.
+    purchaseCounts - an array with the number of purchases of each (user, product) entry.
+    Returns a tuple consisting of a sparse CSR matrix with the purchase count of each product (columns) by each customer (rows),
+    the sorted array of user IDs and the sorted array of product IDs.
+    """
+    # Duplicate (user, product) entries are summed up into purchase counts
+    peopleProductsMatrix = sp.csr_matrix(
+        (np.asarray(purchaseCounts, dtype=np.int64), (userCodes, prodCodes)),
+        shape=(len(encoding.userIDs), len(encoding.productIDs)),
+    )
+    return (
+        peopleProductsMatrix,
+        encoding.userIDs.to_numpy(),
+        encoding.productIDs.to_numpy(),
+    )
+
+
+# Function to create a sparse co-purchasing matrix
+def buildCoPurchaseMatrix(peopleProductsMatrix, workers=1):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse matrix with the purchase count of each product by each customer.
+    workers - a single integer, the number of processes sharing the customers.
+    Returns a sparse CSR matrix with the co-purchase score of every product pair.
+    """
+    if workers > 1:
+        coPurchase = sumCoPurchaseShards(peopleProductsMatrix, workers)
+    else:
+        # Co-purchase score of two products is the dot product of their purchase count columns
+        coPurchase = (peopleProductsMatrix.T @ peopleProductsMatrix).tocsr()
+    # A product is not co-purchased with itself
+    coPurchase.setdiag(0)
+    coPurchase.eliminate_zeros()
+    return coPurchase
+
+
+# Function to get the co-purchase scores contributed by some customers
+def buildCoPurchaseShard(shard):
+    """
+    Parameters:
+    shard - a sparse CSR matrix with the purchase counts of some customers.
+    Returns a sparse CSR matrix with the co-purchase scores of these customers, diagonal included.
+    """
+    return (shard.T @ shard).tocsr()
+
+
+# Function to split customers into shards with about the same number of purchases
+def shardCustomers(peopleProductsMatrix, shardCount):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse CSR matrix with the purchase count of each product by each customer.
+    shardCount - a single integer, the number of shards.
+    Returns a list of sparse CSR matrices, each holding a contiguous range of customers.
+    """
+    # Cut the rows where the running number of stored purchases crosses each share
+    targets = np.linspace(0, peopleProductsMatrix.nnz, shardCount + 1)[1:-1]
+    cuts = np.searchsorted(peopleProductsMatrix.indptr, targets)
+    bounds = np.unique(np.concatenate(([0], cuts, [peopleProductsMatrix.shape[0]])))
+    return [
+        peopleProductsMatrix[start:end]
+        for start, end in zip(bounds[:-1], bounds[1:])
+        if end > start
+    ]
+
+
+# Function to sum the co-purchase scores of customer shards computed in a process pool
+def sumCoPurchaseShards(peopleProductsMatrix, workers):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse matrix with the purchase count of each product by each customer.
+    workers - a single integer, the number of processes.
+    Returns a sparse CSR matrix with the co-purchase score of every product pair, diagonal included.
+    Every customer is in one shard only, so the sum of the integer partial scores
+    is exactly the single process result.
+    """
+    shards = shardCustomers(sp.csr_matrix(peopleProductsMatrix), workers)
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+        partials = list(pool.map(buildCoPurchaseShard, shards))
+    # Add the partial matrices in pairs so each addition works on similar sizes
+    while len(partials) > 1:
+        partials = [
+            partials[i] + partials[i + 1] if i + 1 < len(partials) else partials[i]
+            for i in range(0, len(partials), 2)
+        ]
+    return partials[0].tocsr()
+
+
+# Function to create a sparse product similarity matrix
+def buildSimilarityMatrix(
+    peopleProductsMatrix, scoring="count", workers=1, coPurchase=None
+):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse matrix with the purchase count of each product by each customer.
+    scoring - a string, one of SCORING_MODES:
+        count - the co-purchase score, same as buildCoPurchaseMatrix.
+        cosine - the co-purchase score divided by the norms of both products' purchase counts.
+        jaccard - the share of customers who bought either product that bought both.
+        lift - how many times more customers bought both products than expected by chance.
+        pmi - the positive pointwise mutual information, log of lift with negative values dropped.
+    workers - a single integer, the number of processes sharing the customers.
+    coPurchase - the sparse CSR matrix returned by buildCoPurchaseMatrix for peopleProductsMatrix, if already
+    computed, reused by the count and cosine modes instead of multiplying the matrix again.
+    Returns a sparse CSR matrix with the similarity of every product pair bought by a same customer.
+    """
+    if scoring not in SCORING_MODES:
+        raise ValueError(
+            f"Unknown scoring mode {scoring!r}, expected one of {SCORING_MODES}"
+        )
+    if coPurchase is None and scoring in ("count", "cosine"):
+        coPurchase = buildCoPurchaseMatrix(peopleProductsMatrix, workers)
+    if scoring == "count":
+        return coPurchase
+
+    if scoring == "cosine":
+        # Dot products of the purchase count columns and the norm of each column
+        pairScores = coPurchase
+        productWeights = np.sqrt(
+            np.asarray(peopleProductsMatrix.multiply(peopleProductsMatrix).sum(axis=0))
+        ).ravel()
+    else:
+        # Number of customers who bought both products and who bought each product
+        bought = (peopleProductsMatrix > 0).astype(np.int64)
+        pairScores = buildCoPurchaseMatrix(bought, workers)
+        productWeights = np.asarray(bought.sum(axis=0)).ravel().astype(np.float64)
+
+    # Score every stored pair at once from its row and column weights
+    rows = np.repeat(np.arange(pairScores.shape[0]), np.diff(pairScores.indptr))
+    both = pairScores.data.astype(np.float64)
+    weightI, weightJ = productWeights[rows], productWeights[pairScores.indices]
+    if scoring == "cosine":
+        scores = both / (weightI * weightJ)
+    elif scoring == "jaccard":
+        scores = both / (weightI + weightJ - both)
+    else:
+        customerCount = np.count_nonzero(np.diff(bought.tocsr().indptr))
+        scores = both * customerCount / (weightI * weightJ)
+        if scoring == "pmi":
+            scores = np.maximum(np.log(scores), 0)
+
+    # Copy the structure so dropping zeros never changes a coPurchase matrix passed in
+    similarity = sp.csr_matrix(
+        (scores, pairScores.indices.copy(), pairScores.indptr.copy()),
+        shape=pairScores.shape,
+    )
+    similarity.eliminate_zeros()
+    return similarity
+
+
 # Function to create co-purchasing matrix
 def fillProductCoPurchase(purchasedf):
     """
@@ -38,37 +351,71 @@ def fillProductCoPurchase(purchasedf):
     purchasedf - a data frame storing the purchasing data.
     Returns a tuple consisting of the co-purchasing matrix dataframe and the peopleProducts data frame.
     """
-    # Get a list of unique product IDs
-    prodCols = sorted(list(set(purchasedf["PRODUCT_ID"])))
-    # Create a new data frame for co-purchasing matrix with product IDs as both columns and rows
-    # and fill values with zeros
-    coPurchaseMatrix = pd.DataFrame(data=0, columns=prodCols, index=prodCols)
-    # Call function to create purchase summary
-    peopleProducts = fillPeopleProducts(purchasedf)
-
-    for product_i in coPurchaseMatrix.columns:
-        for product_j in coPurchaseMatrix.index:
-            if product_i != product_j:
-                # Calculate co-purchase score for the product pair
-                copurchaseValue = np.sum(
-                    peopleProducts[product_i] * peopleProducts[product_j]
-                )
-                # Fill values for co-purchasing matrix from purchase summary
-                coPurchaseMatrix.loc[product_i, product_j] = copurchaseValue
+    # Build the co-purchasing matrix in one sparse product instead of comparing every product pair
+    peopleProductsMatrix, userIDs, prodCols = buildPeopleProductsMatrix(purchasedf)
+    coPurchase = buildCoPurchaseMatrix(peopleProductsMatrix)
+    # Create a data frame for co-purchasing matrix with product IDs as both columns and rows
+    coPurchaseMatrix = pd.DataFrame(
+        data=coPurchase.toarray(), columns=prodCols, index=prodCols
+    )
+    # Reuse the sparse matrix for the purchase summary instead of encoding the purchases again
+    peopleProducts = pd.DataFrame.sparse.from_spmatrix(
+        peopleProductsMatrix, index=userIDs, columns=prodCols
+    )
 
     return coPurchaseMatrix, peopleProducts
 
 
+# Function to build the co-purchase neighbor index
+def buildNeighborIndex(coPurchase, prodIDs, topK=TOP_NEIGHBORS):
+    """
+    Parameters:
+    coPurchase - a sparse CSR matrix with the co-purchase score of every product pair.
+    prodIDs - an array of product IDs matching the rows and columns of coPurchase.
+    topK - a single integer, the number of neighbors kept for each product.
+    Returns a NeighborIndex holding the topK highest scoring partners of each product.
+    Partners tied at the maximum score are always kept, even beyond topK.
+    """
+    coPurchase = sp.csr_matrix(coPurchase)
+    coPurchase.eliminate_zeros()
+    rowLengths = np.diff(coPurchase.indptr)
+    rows = np.repeat(np.arange(coPurchase.shape[0]), rowLengths)
+    scores = coPurchase.data
+    # Sort entries by product, then by decreasing score, then by partner position
+    order = np.lexsort((coPurchase.indices, -scores, rows))
+    rows, neighbors, scores = rows[order], coPurchase.indices[order], scores[order]
+    # The first entry of every non-empty row holds its maximum score
+    rowStarts = coPurchase.indptr[:-1]
+    rowMax = np.zeros(coPurchase.shape[0], dtype=scores.dtype)
+    rowMax[rowLengths > 0] = scores[rowStarts[rowLengths > 0]]
+    # Keep the topK entries of each row plus any remaining ties at the maximum
+    rank = np.arange(len(rows)) - rowStarts[rows]
+    keep = (rank < topK) | (scores == rowMax[rows])
+    indptr = np.zeros(coPurchase.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[keep], minlength=coPurchase.shape[0]), out=indptr[1:])
+    return NeighborIndex(
+        pd.Index(prodIDs),
+        indptr,
+        neighbors[keep].astype(np.int32),
+        scores[keep],
+    )
+
+
 # Function to find recommended product IDs
 def findRecProdIDs(coPurchaseMatrix, purchasedProd):
     """
     Parameters:
-    coPurchaseMatrix - a data frame representing the co-purchasing matrix.
+    coPurchaseMatrix - a data frame representing the co-purchasing matrix, a NeighborIndex or a MinHashIndex.
     purchasedProd - a string for purchased product ID.
     Returns:
     A list of items that people are most likely to buy with the purchased product.
     An integer for the maximum co-purchasing score.
     """
+    if isinstance(coPurchaseMatrix, NeighborIndex):
+        return findRecProdIDsFromIndex(coPurchaseMatrix, purchasedProd)
+    if isinstance(coPurchaseMatrix, MinHashIndex):
+        return findRecProdIDsFromMinHash(coPurchaseMatrix, purchasedProd)
+
     maxCoPurchaseScore = coPurchaseMatrix[purchasedProd].max()
     # Filter co-purchase matrix to only product pairs with maximum co-purchase score
     recProdMatrix = coPurchaseMatrix[
@@ -79,15 +426,245 @@ def findRecProdIDs(coPurchaseMatrix, purchasedProd):
     return recProdList, maxCoPurchaseScore
 
 
+# Function to find recommended product IDs from the neighbor index
+def findRecProdIDsFromIndex(neighborIndex, purchasedProd):
+    """
+    Parameters:
+    neighborIndex - a NeighborIndex built by buildNeighborIndex.
+    purchasedProd - a string for purchased product ID.
+    Returns:
+    A list of items that people are most likely to buy with the purchased product,
+    empty if the product was never bought together with another product.
+    An integer for the maximum co-purchasing score.
+    """
+    if purchasedProd not in neighborIndex.productIDs:
+        return [], 0
+    position = neighborIndex.productIDs.get_loc(purchasedProd)
+    start, end = neighborIndex.indptr[position], neighborIndex.indptr[position + 1]
+    if start == end:
+        return [], 0
+    # Neighbors are sorted by score, so the ties at the maximum come first
+    scores = neighborIndex.scores[start:end]
+    maxCoPurchaseScore = scores[0]
+    recPositions = neighborIndex.neighbors[start:end][scores == maxCoPurchaseScore]
+    recProdList = PurchaseData.decodeIDs(neighborIndex.productIDs, recPositions)
+    return recProdList, maxCoPurchaseScore.item()
+
+
+# Function to find recommended product IDs for many products at once
+def findRecProdIDsBatch(neighborIndex, purchasedProds):
+    """
+    Parameters:
+    neighborIndex - a NeighborIndex built by buildNeighborIndex.
+    purchasedProds - a list of strings for purchased product IDs.
+    Returns:
+    A list with, for each purchased product, the list of items people are most likely to buy with it.
+    An array of integers for the maximum co-purchasing score of each purchased product.
+    """
+    positions = neighborIndex.productIDs.get_indexer(purchasedProds)
+    known = positions >= 0
+    starts = np.where(known, neighborIndex.indptr[positions], 0)
+    lengths = np.where(known, neighborIndex.indptr[positions + 1] - starts, 0)
+    # Neighbors are sorted by score, so the first entry of each row is its maximum
+    maxScores = np.zeros(len(positions), dtype=neighborIndex.scores.dtype)
+    maxScores[lengths > 0] = neighborIndex.scores[starts[lengths > 0]]
+
+    # Gather the neighbor entries of all requested rows and keep the ties at the maximum
+    rows = np.repeat(np.arange(len(positions)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    entries = starts[rows] + np.arange(len(rows)) - offsets[rows]
+    isMax = neighborIndex.scores[entries] == maxScores[rows]
+    recIDs = neighborIndex.productIDs[neighborIndex.neighbors[entries[isMax]]]
+    splitAt = np.cumsum(np.bincount(rows[isMax], minlength=len(positions)))[:-1]
+    recProdLists = [ids.tolist() for ids in np.split(np.asarray(recIDs), splitAt)]
+    return recProdLists, maxScores
+
+
+# Function to find recommended product IDs for a basket of purchased products
+def findBasketRecProdIDs(
+    coPurchase, productIDs, basketProds, topK=TOP_NEIGHBORS, aggregate="sum"
+):
+    """
+    Parameters:
+    coPurchase - a sparse CSR matrix with the co-purchase score of every product pair, such as CoPurchaseModel.coPurchase.
+    productIDs - an Index of product IDs matching the rows and columns of coPurchase.
+    basketProds - a list of strings for the product IDs in the basket, at most MAX_BASKET_SIZE.
+    topK - a single integer, the number of products to recommend.
+    aggregate - a string, one of BASKET_AGGREGATES:
+        sum - a product scores the total of its co-purchase scores with the basket items.
+        max - a product scores its best co-purchase score with any basket item.
+    Returns:
+    A list of up to topK product IDs not in the basket, best first, ties broken by product ID.
+    A list with the basket score of each recommended product.
+    """
+    if aggregate not in BASKET_AGGREGATES:
+        raise ValueError(
+            f"Unknown basket aggregate {aggregate!r}, expected one of {BASKET_AGGREGATES}"
+        )
+    if len(basketProds) > MAX_BASKET_SIZE:
+        raise ValueError(f"A basket holds at most {MAX_BASKET_SIZE} products")
+    basketCodes = PurchaseData.encodeIDs(productIDs, basketProds)
+    basketCodes = np.unique(basketCodes[basketCodes >= 0])
+    if len(basketCodes) == 0:
+        return [], []
+
+    # Combine the co-purchase rows of the basket items into one score per product
+    basketRows = coPurchase[basketCodes]
+    if aggregate == "sum":
+        scores = np.asarray(basketRows.sum(axis=0)).ravel()
+    else:
+        scores = basketRows.max(axis=0).toarray().ravel()
+    # Products already in the basket are not recommended
+    scores[basketCodes] = 0
+
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > topK:
+        # Keep the topK best scores and any product tied with the last one
+        cutoff = np.partition(scores[candidates], len(candidates) - topK)[
+            len(candidates) - topK
+        ]
+        candidates = candidates[scores[candidates] >= cutoff]
+    best = candidates[np.lexsort((candidates, -scores[candidates]))][:topK]
+    return PurchaseData.decodeIDs(productIDs, best), scores[best].tolist()
+
+
+# Function to get the number of MinHash values needed for an error bound
+def minHashSignatureSize(errorBound, failureProbability):
+    """
+    Parameters:
+    errorBound - a float, the largest acceptable error of an estimated Jaccard similarity.
+    failureProbability - a float, the probability that an estimate misses the error bound.
+    Returns a single integer, the number of hash functions (Hoeffding bound).
+    """
+    return int(np.ceil(np.log(2 / failureProbability) / (2 * errorBound**2)))
+
+
+# Function to build MinHash signatures of every product
+def buildMinHashIndex(
+    peopleProductsMatrix, prodIDs, errorBound=0.1, failureProbability=0.05, seed=0
+):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse matrix with the purchase count of each product by each customer.
+    prodIDs - an array of product IDs matching the columns of peopleProductsMatrix.
+    errorBound - a float, the largest acceptable error of an estimated Jaccard similarity.
+    failureProbability - a float, the probability that an estimate misses the error bound.
+    seed - a single integer for the random hash functions.
+    Returns a MinHashIndex, whose size only depends on the number of products and hashes.
+    """
+    hashCount = minHashSignatureSize(errorBound, failureProbability)
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, MINHASH_PRIME, size=hashCount)
+    offsets = rng.integers(0, MINHASH_PRIME, size=hashCount)
+
+    # Customers who bought each product are stored next to each other in CSC order
+    bought = sp.csc_matrix(peopleProductsMatrix)
+    buyers = bought.indices.astype(np.int64)
+    buyerCounts = np.diff(bought.indptr)
+    nonEmpty = buyerCounts > 0
+    starts = bought.indptr[:-1][nonEmpty]
+
+    signatures = np.full((bought.shape[1], hashCount), MINHASH_PRIME, dtype=np.int32)
+    # Hash a block of functions at a time to keep the temporary array near 64 MB
+    blockSize = int(np.clip((1 << 23) // max(len(buyers), 1), 1, hashCount))
+    for block in range(0, hashCount, blockSize):
+        hashed = (
+            buyers[:, None] * multipliers[None, block : block + blockSize]
+            + offsets[None, block : block + blockSize]
+        ) % MINHASH_PRIME
+        if len(starts) > 0:
+            signatures[nonEmpty, block : block + blockSize] = np.minimum.reduceat(
+                hashed, starts, axis=0
+            )
+
+    # Sort the bought products by each hash value, one hash at a time, so a lookup
+    # only touches the products that share a value instead of every signature
+    boughtPositions = np.flatnonzero(nonEmpty).astype(np.int32)
+    sortedSignatures = np.empty((hashCount, len(boughtPositions)), dtype=np.int32)
+    sortedProducts = np.empty((hashCount, len(boughtPositions)), dtype=np.int32)
+    for hashNumber in range(hashCount):
+        values = signatures[boughtPositions, hashNumber]
+        order = np.argsort(values, kind="stable")
+        sortedSignatures[hashNumber] = values[order]
+        sortedProducts[hashNumber] = boughtPositions[order]
+    return MinHashIndex(
+        pd.Index(prodIDs), signatures, buyerCounts, sortedSignatures, sortedProducts
+    )
+
+
+# Function to estimate the co-purchase counts of one product with every product
+def estimateCoPurchase(minHashIndex, position):
+    """
+    Parameters:
+    minHashIndex - a MinHashIndex built by buildMinHashIndex.
+    position - a single integer, the position of the purchased product.
+    Returns an array with the estimated number of customers who bought both products,
+    zero for the purchased product itself.
+    """
+    # Products sharing each MinHash value are found by binary search in the sorted rows
+    # (locality sensitive hashing with one hash per band), so only candidates are counted
+    values = minHashIndex.signatures[position]
+    hashCount = len(values)
+    matches = []
+    for hashNumber, value in enumerate(values):
+        row = minHashIndex.sortedSignatures[hashNumber]
+        left = np.searchsorted(row, value, side="left")
+        right = np.searchsorted(row, value, side="right")
+        matches.append(minHashIndex.sortedProducts[hashNumber, left:right])
+    # Share of equal MinHash values estimates the Jaccard similarity
+    similarity = (
+        np.bincount(
+            np.concatenate(matches).astype(np.intp),
+            minlength=len(minHashIndex.productIDs),
+        )
+        / hashCount
+    )
+    buyerCounts = minHashIndex.buyerCounts
+    # |A and B| = J / (1 + J) * (|A| + |B|)
+    estimates = similarity / (1 + similarity) * (buyerCounts + buyerCounts[position])
+    estimates[buyerCounts == 0] = 0
+    estimates[position] = 0
+    return estimates
+
+
+# Function to find recommended product IDs from MinHash signatures
+def findRecProdIDsFromMinHash(minHashIndex, purchasedProd):
+    """
+    Parameters:
+    minHashIndex - a MinHashIndex built by buildMinHashIndex.
+    purchasedProd - a string for purchased product ID.
+    Returns:
+    A list of items that people are most likely to buy with the purchased product,
+    empty if the product is estimated to have no co-purchases.
+    An integer for the estimated maximum number of customers who bought both products.
+    """
+    if purchasedProd not in minHashIndex.productIDs:
+        return [], 0
+    position = minHashIndex.productIDs.get_loc(purchasedProd)
+    if minHashIndex.buyerCounts[position] == 0:
+        return [], 0
+    # Estimates are rounded to whole customers so near equal estimates tie
+    estimates = np.rint(estimateCoPurchase(minHashIndex, position)).astype(np.int64)
+    maxCoPurchaseScore = estimates.max()
+    if maxCoPurchaseScore == 0:
+        return [], 0
+    recPositions = np.flatnonzero(estimates == maxCoPurchaseScore)
+    recProdList = PurchaseData.decodeIDs(minHashIndex.productIDs, recPositions)
+    return recProdList, maxCoPurchaseScore.item()
+
+
 # Function to find items that are most bought by users
 def findMostBought(peopleProducts):
     """
     Parameters:
-    peopleProducts - a data frame summarizing which products were bought by which customer.
+    peopleProducts - a data frame summarizing which products were bought by which customer,
+    a CoPurchaseModel or a PopularityIndex.
     Returns a list of items that have been purchased by more customers than any other item.
     """
+    if isinstance(peopleProducts, PopularityIndex):
+        return peopleProducts.mostBought
     # Get the total number of purchases for each product
-    totalPurchase = peopleProducts.sum(axis=0)
+    totalPurchase = getTotalPurchase(peopleProducts)
     # Filter to get only product with highest number of purchases
     mostBoughtProd = totalPurchase[totalPurchase == totalPurchase.max()]
     # Get a list of most bought product IDs
@@ -95,6 +672,586 @@ def findMostBought(peopleProducts):
     return mostBoughtProd
 
 
+# Function to get the total number of purchases of each product
+def getTotalPurchase(peopleProducts):
+    """
+    Parameters:
+    peopleProducts - a data frame summarizing which products were bought by which customer, or a CoPurchaseModel.
+    Returns a series with the total number of purchases, indexed by product ID.
+    """
+    if isinstance(peopleProducts, CoPurchaseModel):
+        return pd.Series(peopleProducts.totalPurchase, index=peopleProducts.productIDs)
+    return peopleProducts.sum(axis=0)
+
+
+# Function to get the top products of a ranking, ties included
+def findTopWithTies(totalPurchase, topN):
+    """
+    Parameters:
+    totalPurchase - a series with the total number of purchases, indexed by product ID.
+    topN - a single integer, the number of products wanted.
+    Returns a list of the topN most bought product IDs, best first, plus every product tied with the last one.
+    """
+    totalPurchase = totalPurchase[totalPurchase > 0]
+    if len(totalPurchase) == 0:
+        return []
+    # Sort by total, then by product ID so the order is stable
+    ranked = totalPurchase.iloc[
+        np.lexsort((totalPurchase.index.to_numpy(), -totalPurchase.to_numpy()))
+    ]
+    lastTotal = ranked.iloc[min(topN, len(ranked)) - 1]
+    return ranked[ranked >= lastTotal].index.to_list()
+
+
+# Function to precompute the most bought products overall and in each category
+def buildPopularityIndex(peopleProducts, productdf, topN=TOP_POPULAR):
+    """
+    Parameters:
+    peopleProducts - a data frame summarizing which products were bought by which customer, or a CoPurchaseModel.
+    productdf - a data frame storing the product data, with the CATEGORY column added by reformatProdData.
+    topN - a single integer, the number of products kept overall and for each category.
+    Returns a PopularityIndex.
+    """
+    totalPurchase = getTotalPurchase(peopleProducts)
+    productCategory = dict(zip(productdf["PRODUCT_ID"], productdf["CATEGORY"]))
+    categories = totalPurchase.index.map(productCategory)
+    byCategory = {
+        category: findTopWithTies(categoryTotal, topN)
+        for category, categoryTotal in totalPurchase.groupby(categories)
+    }
+    return PopularityIndex(
+        findMostBought(peopleProducts),
+        findTopWithTies(totalPurchase, topN),
+        byCategory,
+        productCategory,
+    )
+
+
+# Function to find popular products to recommend when there is no co-purchase
+def findPopularProdIDs(popularityIndex, purchasedProd):
+    """
+    Parameters:
+    popularityIndex - a PopularityIndex built by buildPopularityIndex.
+    purchasedProd - a string for purchased product ID.
+    Returns a list of the most bought products in the category of the purchased product,
+    or overall when the category has no other bought product.
+    """
+    category = popularityIndex.productCategory.get(purchasedProd)
+    recProdList = [
+        productID
+        for productID in popularityIndex.byCategory.get(category, [])
+        if productID != purchasedProd
+    ]
+    if len(recProdList) == 0:
+        return popularityIndex.overall
+    return recProdList
+
+
+# Function to create the co-purchasing model
+def buildCoPurchaseModel(purchasedf, topK=TOP_NEIGHBORS, scoring="count"):
+    """
+    Parameters:
+    purchasedf - a data frame storing the purchasing data.
+    topK - a single integer, the number of neighbors kept for each product.
+    scoring - a string, one of SCORING_MODES, used to rank the neighbors.
+    Returns a CoPurchaseModel built from all purchases.
+    """
+    peopleProductsMatrix, userIDs, prodIDs = buildPeopleProductsMatrix(purchasedf)
+    return buildCoPurchaseModelFromMatrix(
+        peopleProductsMatrix, userIDs, prodIDs, topK, scoring
+    )
+
+
+# Function to create the co-purchasing model from a sparse purchase summary
+def buildCoPurchaseModelFromMatrix(
+    peopleProductsMatrix,
+    userIDs,
+    prodIDs,
+    topK=TOP_NEIGHBORS,
+    scoring="count",
+    workers=1,
+):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse CSR matrix with the purchase count of each product by each customer.
+    userIDs - an array of user IDs matching the rows of peopleProductsMatrix.
+    prodIDs - an array of product IDs matching the columns of peopleProductsMatrix.
+    topK - a single integer, the number of neighbors kept for each product.
+    scoring - a string, one of SCORING_MODES, used to rank the neighbors.
+    workers - a single integer, the number of processes sharing the customers.
+    Returns a CoPurchaseModel.
+    """
+    coPurchase = buildCoPurchaseMatrix(peopleProductsMatrix, workers)
+    similarity = buildSimilarityMatrix(
+        peopleProductsMatrix, scoring, workers, coPurchase
+    )
+    return CoPurchaseModel(
+        userIDs,
+        prodIDs,
+        peopleProductsMatrix,
+        coPurchase,
+        np.asarray(peopleProductsMatrix.sum(axis=0)).ravel(),
+        buildNeighborIndex(similarity, prodIDs, topK),
+        topK,
+        scoring,
+    )
+
+
+# Function to rebuild the neighbors of some products in a neighbor index
+def updateNeighborIndex(neighborIndex, coPurchase, productIDs, changedProducts, topK):
+    """
+    Parameters:
+    neighborIndex - the NeighborIndex to update, possibly covering fewer products than coPurchase.
+    coPurchase - a sparse CSR matrix with the up to date co-purchase scores.
+    productIDs - an Index of product IDs matching the rows and columns of coPurchase.
+    changedProducts - an array of product positions whose co-purchase rows changed.
+    topK - a single integer, the number of neighbors kept for each product.
+    Returns a new NeighborIndex where only the rows of changedProducts were recomputed.
+    """
+    productCount = coPurchase.shape[0]
+    changed = np.zeros(productCount, dtype=bool)
+    changed[changedProducts] = True
+    changedPositions = np.flatnonzero(changed)
+    # Rank the neighbors of the changed products only
+    changedIndex = buildNeighborIndex(
+        coPurchase[changedPositions], productIDs[changedPositions], topK
+    )
+    changedLengths = np.diff(changedIndex.indptr)
+
+    # Work out where every row starts in the new arrays
+    oldCount = len(neighborIndex.indptr) - 1
+    rowLengths = np.zeros(productCount, dtype=np.int64)
+    rowLengths[:oldCount] = np.diff(neighborIndex.indptr)
+    rowLengths[changedPositions] = changedLengths
+    indptr = np.zeros(productCount + 1, dtype=np.int64)
+    np.cumsum(rowLengths, out=indptr[1:])
+    neighbors = np.empty(indptr[-1], dtype=neighborIndex.neighbors.dtype)
+    scores = np.empty(indptr[-1], dtype=coPurchase.dtype)
+
+    # Copy the rows that did not change
+    oldRows = np.repeat(np.arange(oldCount), np.diff(neighborIndex.indptr))
+    keep = ~changed[oldRows]
+    target = indptr[oldRows] + np.arange(len(oldRows)) - neighborIndex.indptr[oldRows]
+    neighbors[target[keep]] = neighborIndex.neighbors[keep]
+    scores[target[keep]] = neighborIndex.scores[keep]
+    # Place the recomputed rows
+    localRows = np.repeat(np.arange(len(changedPositions)), changedLengths)
+    target = (
+        indptr[changedPositions[localRows]]
+        + np.arange(len(localRows))
+        - changedIndex.indptr[localRows]
+    )
+    neighbors[target] = changedIndex.neighbors
+    scores[target] = changedIndex.scores
+    return NeighborIndex(productIDs, indptr, neighbors, scores)
+
+
+# Function to add new purchases to the co-purchasing model
+def updateCoPurchaseModel(model, newPurchasedf):
+    """
+    Parameters:
+    model - a CoPurchaseModel, updated in place.
+    newPurchasedf - a data frame with new purchase rows (USER_ID and PRODUCT_ID columns).
+    Returns no value.
+    Only the customers in newPurchasedf are used to update the co-purchase scores,
+    so with the count scoring the cost depends on the size of the new batch and not on
+    the whole history. Other scoring modes normalize by product and customer totals, so
+    their neighbor index is rebuilt from the whole similarity matrix on every update.
+    """
+    if len(newPurchasedf) == 0:
+        return
+    # Encode the new purchases, users and products not seen before get the next free codes
+    model.userIDs, userCodes = PurchaseData.extendIDs(
+        model.userIDs, newPurchasedf["USER_ID"].to_numpy()
+    )
+    model.productIDs, prodCodes = PurchaseData.extendIDs(
+        model.productIDs, newPurchasedf["PRODUCT_ID"].to_numpy()
+    )
+    userCount, productCount = len(model.userIDs), len(model.productIDs)
+    model.peopleProductsMatrix.resize((userCount, productCount))
+    model.coPurchase.resize((productCount, productCount))
+    model.totalPurchase = np.pad(
+        model.totalPurchase, (0, productCount - len(model.totalPurchase))
+    )
+
+    counted = (userCodes >= 0) & (prodCodes >= 0)
+    if "PURCHASE" in newPurchasedf:
+        counted &= newPurchasedf["PURCHASE"].notna().to_numpy()
+    applyPurchaseCounts(
+        model,
+        userCodes[counted],
+        prodCodes[counted],
+        np.ones(counted.sum(), dtype=np.int64),
+    )
+
+
+# Function to add or remove purchase counts of the co-purchasing model
+def applyPurchaseCounts(model, userCodes, prodCodes, counts):
+    """
+    Parameters:
+    model - a CoPurchaseModel, updated in place, already sized for all codes.
+    userCodes - an array of user codes.
+    prodCodes - an array of product codes matching userCodes.
+    counts - an array with the purchase count change of each (user, product) entry, negative to remove purchases.
+    Returns no value.
+    Only the count scoring updates its neighbor index incrementally, other modes rescore every product.
+    """
+    userCount, productCount = len(model.userIDs), len(model.productIDs)
+    # Purchase counts of the affected customers before and after the change
+    affectedUsers = np.unique(userCodes)
+    userRows = np.searchsorted(affectedUsers, userCodes)
+    countChange = sp.csr_matrix(
+        (counts, (userRows, prodCodes)),
+        shape=(len(affectedUsers), productCount),
+    )
+    oldRows = model.peopleProductsMatrix[affectedUsers]
+    updatedRows = (oldRows + countChange).tocsr()
+    updatedRows.eliminate_zeros()
+
+    # Only the products bought by the affected customers have new co-purchase scores
+    delta = (updatedRows.T @ updatedRows - oldRows.T @ oldRows).tocsr()
+    delta.setdiag(0)
+    model.coPurchase = (model.coPurchase + delta).tocsr()
+    model.coPurchase.eliminate_zeros()
+    model.peopleProductsMatrix = (
+        model.peopleProductsMatrix
+        + sp.csr_matrix(
+            (counts, (userCodes, prodCodes)),
+            shape=(userCount, productCount),
+        )
+    ).tocsr()
+    model.peopleProductsMatrix.eliminate_zeros()
+    model.totalPurchase += np.bincount(
+        prodCodes, weights=counts, minlength=productCount
+    ).astype(model.totalPurchase.dtype)
+    if model.scoring == "count":
+        model.neighborIndex = updateNeighborIndex(
+            model.neighborIndex,
+            model.coPurchase,
+            model.productIDs,
+            np.union1d(oldRows.indices, updatedRows.indices),
+            model.topK,
+        )
+    else:
+        # Normalized scores depend on product and customer totals, so every row is rescored
+        model.neighborIndex = buildNeighborIndex(
+            buildSimilarityMatrix(
+                model.peopleProductsMatrix, model.scoring, coPurchase=model.coPurchase
+            ),
+            model.productIDs,
+            model.topK,
+        )
+
+
+# Function to create a co-purchasing model limited to a sliding time window
+def buildWindowedCoPurchaseModel(
+    purchasedf,
+    windowLength,
+    bucketLength=None,
+    currentTime=None,
+    topK=TOP_NEIGHBORS,
+    scoring="count",
+):
+    """
+    Parameters:
+    purchasedf - a data frame storing the purchasing data, with an optional TIMESTAMP column.
+    windowLength - a pandas Timedelta (or a string such as "30D"), how far back purchases are counted.
+    bucketLength - a pandas Timedelta, the time granularity of expiry, defaults to a tenth of windowLength.
+    currentTime - a pandas Timestamp, defaults to the latest purchase time.
+    topK - a single integer, the number of neighbors kept for each product.
+    scoring - a string, one of SCORING_MODES, used to rank the neighbors.
+    Returns a WindowedCoPurchaseModel holding the purchases of the window.
+    """
+    windowLength = pd.Timedelta(windowLength)
+    bucketLength = pd.Timedelta(bucketLength or windowLength / 10)
+    emptyMatrix = sp.csr_matrix((0, 0), dtype=np.int64)
+    model = WindowedCoPurchaseModel(
+        [],
+        [],
+        emptyMatrix,
+        emptyMatrix.copy(),
+        np.zeros(0, dtype=np.int64),
+        buildNeighborIndex(emptyMatrix, pd.Index([]), topK),
+        topK,
+        scoring,
+        windowLength,
+        bucketLength,
+    )
+    advanceWindow(model, purchasedf, currentTime)
+    return model
+
+
+# Function to add new purchases to a windowed model and forget the ones that left the window
+def advanceWindow(model, newPurchasedf=None, currentTime=None):
+    """
+    Parameters:
+    model - a WindowedCoPurchaseModel, updated in place.
+    newPurchasedf - a data frame with new purchase rows, with an optional TIMESTAMP column.
+        Rows without TIMESTAMP are taken as bought at currentTime.
+    currentTime - a pandas Timestamp, defaults to the latest of the model time and the new purchases.
+    Returns no value.
+    New and expired purchases are applied as one change, so with the count scoring the cost
+    depends on the customers involved and not on the whole window. Other scoring modes
+    rebuild their neighbor index from the whole similarity matrix on every call.
+    """
+    if newPurchasedf is None:
+        newPurchasedf = pd.DataFrame(columns=["USER_ID", "PRODUCT_ID"])
+    if PurchaseData.TIMESTAMP in newPurchasedf:
+        timestamps = pd.to_datetime(newPurchasedf[PurchaseData.TIMESTAMP]).to_numpy()
+    else:
+        fallbackTime = currentTime or model.currentTime or pd.Timestamp.now()
+        timestamps = np.full(len(newPurchasedf), pd.Timestamp(fallbackTime).asm8)
+    candidates = [model.currentTime, currentTime]
+    if len(timestamps) > 0:
+        candidates.append(pd.Timestamp(timestamps.max()))
+    candidates = [pd.Timestamp(time) for time in candidates if time is not None]
+    if len(candidates) == 0:
+        return
+    model.currentTime = currentTime = max(candidates)
+    windowStart = currentTime - model.windowLength
+
+    # Encode the new purchases, users and products not seen before get the next free codes
+    model.userIDs, userCodes = PurchaseData.extendIDs(
+        model.userIDs, newPurchasedf["USER_ID"].to_numpy()
+    )
+    model.productIDs, prodCodes = PurchaseData.extendIDs(
+        model.productIDs, newPurchasedf["PRODUCT_ID"].to_numpy()
+    )
+    userCount, productCount = len(model.userIDs), len(model.productIDs)
+    model.peopleProductsMatrix.resize((userCount, productCount))
+    model.coPurchase.resize((productCount, productCount))
+    model.totalPurchase = np.pad(
+        model.totalPurchase, (0, productCount - len(model.totalPurchase))
+    )
+
+    # Purchases in buckets that already left the window are never counted
+    bucketNumbers = (timestamps - np.datetime64(0, "ns")) // model.bucketLength.asm8
+    lastExpired = (windowStart - pd.Timestamp(0)) // model.bucketLength - 1
+    counted = (userCodes >= 0) & (prodCodes >= 0) & (bucketNumbers > lastExpired)
+    if "PURCHASE" in newPurchasedf:
+        counted &= newPurchasedf["PURCHASE"].notna().to_numpy()
+    userCodes, prodCodes = userCodes[counted], prodCodes[counted]
+    bucketNumbers = bucketNumbers[counted]
+
+    # Keep the new purchases in their time buckets
+    for bucketNumber in np.unique(bucketNumbers):
+        inBucket = bucketNumbers == bucketNumber
+        bucketUsers, bucketProducts = model.buckets.get(bucketNumber, ([], []))
+        model.buckets[bucketNumber] = (
+            np.concatenate((bucketUsers, userCodes[inBucket])).astype(np.int32),
+            np.concatenate((bucketProducts, prodCodes[inBucket])).astype(np.int32),
+        )
+
+    # Buckets that ended before the window start are removed
+    changedUsers, changedProducts = [userCodes], [prodCodes]
+    for bucketNumber in sorted(model.buckets):
+        if bucketNumber > lastExpired:
+            break
+        expiredUsers, expiredProducts = model.buckets.pop(bucketNumber)
+        changedUsers.append(expiredUsers)
+        changedProducts.append(expiredProducts)
+
+    changedUsers = np.concatenate(changedUsers).astype(np.int64)
+    if len(changedUsers) > 0:
+        counts = -np.ones(len(changedUsers), dtype=np.int64)
+        counts[: len(userCodes)] = 1
+        applyPurchaseCounts(
+            model,
+            changedUsers,
+            np.concatenate(changedProducts).astype(np.int64),
+            counts,
+        )
+    compactWindowedModel(model)
+
+
+# Function to drop the customers who have no purchase left in the window
+def compactWindowedModel(model):
+    """
+    Parameters:
+    model - a WindowedCoPurchaseModel, updated in place.
+    Returns no value.
+    Customers are only dropped once they are half of all rows, so the cost of renumbering
+    is spread over many updates while memory stays bounded by the window.
+    """
+    active = np.diff(model.peopleProductsMatrix.indptr) > 0
+    if active.sum() * 2 >= len(active):
+        return
+    newCodes = np.cumsum(active, dtype=np.int64) - 1
+    model.userIDs = model.userIDs[active]
+    model.peopleProductsMatrix = model.peopleProductsMatrix[active]
+    for bucketNumber, (userCodes, prodCodes) in model.buckets.items():
+        model.buckets[bucketNumber] = (
+            newCodes[userCodes].astype(np.int32),
+            prodCodes,
+        )
+
+
+# Function to compute the content hash of a data file
+def hashFile(filePath):
+    """
+    Parameters:
+    filePath - a string for the path of the file.
+    Returns a string with the SHA-256 hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(filePath, "rb") as dataFile:
+        for block in iter(lambda: dataFile.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to get the cache name prefix of the purchase data
+def getDataVersion(purchasePath):
+    """
+    Parameters:
+    purchasePath - a string for the path of purchases.csv.
+    Returns a tuple consisting of the cache name prefix of the file content
+    and an array with the size and modification time of the file.
+    The file is only hashed when no cache folder was built from a file of the same size and modification time.
+    """
+    dataFolder = os.path.dirname(os.path.abspath(purchasePath))
+    fileInfo = os.stat(purchasePath)
+    sourceStamp = np.array([fileInfo.st_size, fileInfo.st_mtime_ns], dtype=np.int64)
+    versionPrefix = MODEL_CACHE_PREFIX + MODEL_CACHE_VERSION + "-"
+    for fileName in os.listdir(dataFolder):
+        stampPath = os.path.join(dataFolder, fileName, SOURCE_STAMP_FILE)
+        if (
+            fileName.startswith(versionPrefix)
+            and os.path.isfile(stampPath)
+            and np.array_equal(np.load(stampPath), sourceStamp)
+        ):
+            # Cache folders are named after the first 16 characters of the hash
+            return fileName[: len(versionPrefix) + 16], sourceStamp
+    return versionPrefix + hashFile(purchasePath)[:16], sourceStamp
+
+
+# Function to save the co-purchasing model as memory-mappable arrays
+def saveCoPurchaseModel(model, cacheFolder):
+    """
+    Parameters:
+    model - a CoPurchaseModel.
+    cacheFolder - a string for the folder to write the .npy files to, replaced if it exists.
+    Returns no value.
+    """
+    arrays = {
+        # IDs are stored as numeric or fixed width string arrays so they can be memory-mapped too
+        "userIDs": np.array(model.userIDs.to_list()),
+        "productIDs": np.array(model.productIDs.to_list()),
+        "peopleData": model.peopleProductsMatrix.data,
+        "peopleIndices": model.peopleProductsMatrix.indices,
+        "peopleIndptr": model.peopleProductsMatrix.indptr,
+        "coPurchaseData": model.coPurchase.data,
+        "coPurchaseIndices": model.coPurchase.indices,
+        "coPurchaseIndptr": model.coPurchase.indptr,
+        "totalPurchase": model.totalPurchase,
+        "neighborIndptr": model.neighborIndex.indptr,
+        "neighbors": model.neighborIndex.neighbors,
+        "neighborScores": model.neighborIndex.scores,
+        "topK": np.array(model.topK),
+        "scoring": np.array(model.scoring),
+    }
+    # Write into a temporary folder first so a crash never leaves a half written cache
+    tempFolder = cacheFolder + ".tmp"
+    shutil.rmtree(tempFolder, ignore_errors=True)
+    os.makedirs(tempFolder)
+    for name, array in arrays.items():
+        np.save(os.path.join(tempFolder, name + ".npy"), array)
+    shutil.rmtree(cacheFolder, ignore_errors=True)
+    os.replace(tempFolder, cacheFolder)
+
+
+# Function to load the co-purchasing model saved by saveCoPurchaseModel
+def loadCoPurchaseModel(cacheFolder):
+    """
+    Parameters:
+    cacheFolder - a string for the folder holding the .npy files.
+    Returns a CoPurchaseModel whose arrays are memory-mapped from the cache files.
+    """
+    arrays = {}
+    for fileName in os.listdir(cacheFolder):
+        name = os.path.splitext(fileName)[0]
+        arrays[name] = np.load(os.path.join(cacheFolder, fileName), mmap_mode="r")
+    userCount, productCount = len(arrays["userIDs"]), len(arrays["productIDs"])
+    productIDs = pd.Index(arrays["productIDs"])
+    return CoPurchaseModel(
+        arrays["userIDs"],
+        productIDs,
+        sp.csr_matrix(
+            (arrays["peopleData"], arrays["peopleIndices"], arrays["peopleIndptr"]),
+            shape=(userCount, productCount),
+        ),
+        sp.csr_matrix(
+            (
+                arrays["coPurchaseData"],
+                arrays["coPurchaseIndices"],
+                arrays["coPurchaseIndptr"],
+            ),
+            shape=(productCount, productCount),
+        ),
+        arrays["totalPurchase"],
+        NeighborIndex(
+            productIDs,
+            arrays["neighborIndptr"],
+            arrays["neighbors"],
+            arrays["neighborScores"],
+        ),
+        int(arrays["topK"]),
+        str(arrays["scoring"]),
+    )
+
+
+# Function to get the co-purchasing model from the cache or build it
+def getCoPurchaseModel(purchasePath, topK=TOP_NEIGHBORS, scoring="count", workers=1):
+    """
+    Parameters:
+    purchasePath - a string for the path of purchases.csv.
+    topK - a single integer, the number of neighbors kept for each product.
+    scoring - a string, one of SCORING_MODES, used to rank the neighbors.
+    workers - a single integer, the number of processes used when the model is built.
+    Returns a CoPurchaseModel.
+    The model is cached next to purchases.csv, keyed by the hash of its content,
+    so it is only rebuilt when the purchase data changes. The file is only hashed again
+    when its size or modification time differs from the ones saved with the cache.
+    """
+    dataFolder = os.path.dirname(os.path.abspath(purchasePath))
+    dataVersion, sourceStamp = getDataVersion(purchasePath)
+    cacheName = dataVersion + f"-k{topK}-{scoring}"
+    cacheFolder = os.path.join(dataFolder, cacheName)
+    stampPath = os.path.join(cacheFolder, SOURCE_STAMP_FILE)
+    if os.path.isdir(cacheFolder):
+        print("\nLoading the cached co-purchasing matrix...\n")
+        # Remember the file stamp, such as after a copy with unchanged content
+        if not os.path.isfile(stampPath) or not np.array_equal(
+            np.load(stampPath), sourceStamp
+        ):
+            np.save(stampPath, sourceStamp)
+        return loadCoPurchaseModel(cacheFolder)
+
+    print("\nPreparing the co-purchasing matrix...\n")
+    # Stream the purchases so only the per customer counts are kept in memory
+    summary = PurchaseData.streamPurchaseSummary(purchasePath)
+    model = buildCoPurchaseModelFromMatrix(
+        *buildPeopleProductsMatrixFromCodes(
+            summary.encoding,
+            summary.userCodes,
+            summary.productCodes,
+            summary.purchaseCounts,
+        ),
+        topK,
+        scoring,
+        workers,
+    )
+    # Remove caches of older purchase data or layouts before saving the new one
+    for fileName in os.listdir(dataFolder):
+        if fileName.startswith(MODEL_CACHE_PREFIX) and not fileName.startswith(
+            dataVersion
+        ):
+            shutil.rmtree(os.path.join(dataFolder, fileName), ignore_errors=True)
+    saveCoPurchaseModel(model, cacheFolder)
+    np.save(stampPath, sourceStamp)
+    return model
+
+
 # Function to format product data
 def reformatProdData(productdf):
     """
@@ -111,37 +1268,125 @@ def reformatProdData(productdf):
         productdf.DESCRIPTION.str.split(pat="(").str.get(0).str.strip()
     )
     # Reformat price column
-    productdf["PRICE"] = pd.to_numeric(productdf["PRICE"], errors="coerce")
-    productdf["PRICE"].fillna(value=0, inplace=True)
+    productdf["PRICE"] = pd.to_numeric(productdf["PRICE"], errors="coerce").fillna(
+        value=0
+    )
 
 
-# Function to format printout of recommended products
-def printRecProducts(productdf, recProdIDs):
+# Function to prepare the product data used to display recommendations
+def buildProductIndex(productdf):
     """
     Parameters:
-    productdf - a data frame storing the product data.
+    productdf - a data frame storing the product data, formatted by reformatProdData.
+    Returns a ProductIndex with the display text of every product worked out once.
+    """
+    # Keep the first row of each product ID, in data file order
+    products = productdf.drop_duplicates(subset="PRODUCT_ID")
+    # Only display price if price is available
+    prices = "$" + products["PRICE"].map(lambda price: format(price, "10.2f").strip())
+    details = ("-- " + products["DESCRIPTION"]).where(
+        products["PRICE"] == 0, "-- " + products["DESCRIPTION"] + ", " + prices
+    )
+    return ProductIndex(
+        pd.Index(products["PRODUCT_ID"]),
+        products["CATEGORY"].to_numpy(dtype=object),
+        products["CATEGORY"].str.upper().to_numpy(dtype=object),
+        details.to_numpy(dtype=object),
+    )
+
+
+# Function to format the lines describing recommended products from a ProductIndex
+def formatRecProductsFromIndex(productIndex, recProdIDs, ranked=False):
+    """
+    Parameters:
+    productIndex - a ProductIndex built by buildProductIndex.
     recProdIDs - a list of recommended product ids.
-    Returns no value.
+    ranked - a boolean, True to keep the order of recProdIDs instead of sorting by category.
+    Returns a list of strings, one line per recommended product, in the same layout as formatRecProducts.
     """
+    # Look up the product codes, unknown products are left out
+    codes = PurchaseData.encodeIDs(productIndex.productIDs, recProdIDs)
+    if ranked:
+        codes = pd.unique(codes[codes >= 0])
+    else:
+        codes = np.unique(codes[codes >= 0])
+        # Sort by category, products of a same category stay in data file order
+        codes = sorted(codes, key=lambda code: productIndex.categories[code])
+    if len(codes) == 0:
+        return []
+    # Get the maximum length of category strings to help with formatting
+    maxLength = max(len(productIndex.labels[code]) for code in codes)
+    return [
+        " ".join(
+            [
+                "IN",
+                productIndex.labels[code].ljust(maxLength),
+                productIndex.details[code],
+            ]
+        )
+        for code in codes
+    ]
+
+
+# Function to format the lines describing recommended products
+def formatRecProducts(productdf, recProdIDs, ranked=False):
+    """
+    Parameters:
+    productdf - a data frame storing the product data, or a ProductIndex.
+    recProdIDs - a list of recommended product ids.
+    ranked - a boolean, True to keep the order of recProdIDs instead of sorting by category.
+    Returns a list of strings, one line per recommended product.
+    """
+    if isinstance(productdf, ProductIndex):
+        return formatRecProductsFromIndex(productdf, recProdIDs, ranked)
     # Filter data frame to keep only recommended product IDs
     recProducts = productdf[productdf["PRODUCT_ID"].isin(recProdIDs)]
-    # Sort data frame by categories
-    recProducts = recProducts.sort_values(by=["CATEGORY"])
+    if ranked:
+        # Order rows as in the recommendation list
+        rank = {productID: position for position, productID in enumerate(recProdIDs)}
+        recProducts = recProducts.iloc[
+            np.argsort(recProducts["PRODUCT_ID"].map(rank).to_numpy(), kind="stable")
+        ]
+    else:
+        # Sort data frame by categories
+        recProducts = recProducts.sort_values(by=["CATEGORY"])
     # Get the maximum length of category strings to help with formatting
     maxLength = recProducts["CATEGORY"].str.len().max()
 
+    lines = []
     for row in recProducts.itertuples():
         # Only display price if price is available
         if row.PRICE != 0:
-            print(
-                "IN",
-                row.CATEGORY.ljust(maxLength).upper(),
-                "--",
-                row.DESCRIPTION + ",",
-                "$" + format(row.PRICE, "10.2f").strip(),
+            lines.append(
+                " ".join(
+                    [
+                        "IN",
+                        row.CATEGORY.ljust(maxLength).upper(),
+                        "--",
+                        row.DESCRIPTION + ",",
+                        "$" + format(row.PRICE, "10.2f").strip(),
+                    ]
+                )
             )
         else:
-            print("IN", row.CATEGORY.ljust(maxLength).upper(), "--", row.DESCRIPTION)
+            lines.append(
+                " ".join(
+                    ["IN", row.CATEGORY.ljust(maxLength).upper(), "--", row.DESCRIPTION]
+                )
+            )
+    return lines
+
+
+# Function to format printout of recommended products
+def printRecProducts(productdf, recProdIDs):
+    """
+    Parameters:
+    productdf - a data frame storing the product data, or a ProductIndex.
+    recProdIDs - a list of recommended product ids.
+    Returns no value.
+    """
+    for line in formatRecProducts(productdf, recProdIDs):
+        print(line)
 
 
 def main():
@@ -149,20 +1394,25 @@ def main():
     folderName = input(
         "Please enter the name of folder with product and purchase data files: (prod.csv and purchases.csv): "
     )
-    purchasedf = pd.read_csv(os.path.join(os.getcwd(), folderName, "purchases.csv"))
-    productdf = pd.read_csv(os.path.join(os.getcwd(), folderName, "prod.csv"))
+    productdf = PurchaseData.readDataFile(
+        os.path.join(os.getcwd(), folderName, "prod.csv")
+    )
     # Convert all product IDs to uppercase for consistency
-    purchasedf["PRODUCT_ID"] = purchasedf["PRODUCT_ID"].str.upper()
     productdf["PRODUCT_ID"] = productdf["PRODUCT_ID"].str.upper()
 
     # Get a list of unique product IDs
     allProd = sorted(list(set(productdf["PRODUCT_ID"])))
 
     # Process data to get neccessary information
-    print("\nPreparing the co-purchasing matrix...\n")
-    coPurchaseMatrix, peopleProducts = fillProductCoPurchase(purchasedf)
-    mostBoughtProd = findMostBought(peopleProducts)
+    # Share the customers among all CPU cores when the model has to be built
+    model = getCoPurchaseModel(
+        os.path.join(os.getcwd(), folderName, "purchases.csv"),
+        workers=os.cpu_count(),
+    )
     reformatProdData(productdf)
+    popularity = buildPopularityIndex(model, productdf)
+    productIndex = buildProductIndex(productdf)
+    PurchaseData.reportPeakMemory()
 
     # Get bought product ID
     productID = (
@@ -176,13 +1426,13 @@ def main():
         if productID in allProd:
             # Get co-purchase score and list of recommended product IDs
             likelyToBuyList, maxCoPurchaseScore = findRecProdIDs(
-                coPurchaseMatrix, productID
+                model.neighborIndex, productID
             )
             print(f"[Maximum co-purchasing score {maxCoPurchaseScore}]")
 
             if maxCoPurchaseScore == 0:
-                # Recommend most popular products in general
-                recProductList = mostBoughtProd
+                # Recommend most popular products in the same category
+                recProductList = findPopularProdIDs(popularity, productID)
                 recommendType = "Suggest one of our most popular products:\n"
             else:
                 # Recommend most likely to buy together products
@@ -192,7 +1442,7 @@ def main():
             print("Recommend with", productID, ":", recProductList)
             print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
             print(recommendType)
-            printRecProducts(productdf, recProductList)
+            printRecProducts(productIndex, recProductList)
             print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
 
         productID = (
@@ -205,4 +1455,5 @@ def main():
     print("Bye!")
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+@author: Linh Vo
+@purpose: This program precomputes recommendations for many purchased products at once and writes them as CSV or JSONL.
+Usage: python RecommendationBatch.py pdata --input ids.txt --output recs.csv
+       python RecommendationBatch.py pdata --all --format jsonl --display
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import sys
+
+import PurchaseData
+import Recommendation
+
+# Number of product IDs answered per vectorized lookup
+BATCH_SIZE = 10000
+OUTPUT_COLUMNS = ["PRODUCT_ID", "SCORE", "RECOMMEND_TYPE", "RECOMMENDED"]
+# Extra column with the display lines, written with --display
+DISPLAY_COLUMN = "DISPLAY"
+
+
+# Function to read product IDs in batches
+def readProductIDs(idStream, batchSize=BATCH_SIZE):
+    """
+    Parameters:
+    idStream - a text stream with one product ID per line.
+    batchSize - a single integer, the number of IDs per batch.
+    Yields lists of upper-cased product IDs, skipping blank lines.
+    """
+    batch = []
+    for line in idStream:
+        productID = line.strip().upper()
+        if productID != "":
+            batch.append(productID)
+        if len(batch) == batchSize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Function to create the recommendation records for a batch of product IDs
+def recommendBatch(model, productIDs, popularity, productIndex=None):
+    """
+    Parameters:
+    model - a CoPurchaseModel.
+    productIDs - a list of strings for purchased product IDs.
+    popularity - a Recommendation.PopularityIndex, used when there is no co-purchase.
+    productIndex - a Recommendation.ProductIndex to add the DISPLAY lines, or None.
+    Returns a list of dictionaries with the OUTPUT_COLUMNS of each product.
+    """
+    recProdLists, maxScores = Recommendation.findRecProdIDsBatch(
+        model.neighborIndex, productIDs
+    )
+    records = []
+    for productID, recProdList, maxScore in zip(productIDs, recProdLists, maxScores):
+        if maxScore == 0:
+            # Recommend most popular products in the same category
+            records.append(
+                {
+                    "PRODUCT_ID": productID,
+                    "SCORE": 0,
+                    "RECOMMEND_TYPE": "popular",
+                    "RECOMMENDED": Recommendation.findPopularProdIDs(
+                        popularity, productID
+                    ),
+                }
+            )
+        else:
+            records.append(
+                {
+                    "PRODUCT_ID": productID,
+                    "SCORE": maxScore.item(),
+                    "RECOMMEND_TYPE": "co-purchase",
+                    "RECOMMENDED": recProdList,
+                }
+            )
+    if productIndex is not None:
+        for record in records:
+            record[DISPLAY_COLUMN] = Recommendation.formatRecProducts(
+                productIndex, record["RECOMMENDED"]
+            )
+    return records
+
+
+# Function to write recommendation records to a stream
+def writeRecords(records, outStream, outputFormat, writer=None):
+    """
+    Parameters:
+    records - a list of dictionaries with the OUTPUT_COLUMNS.
+    outStream - a text stream to write to.
+    outputFormat - a string, "csv" or "jsonl".
+    writer - the csv.DictWriter returned by a previous call, if any.
+    Returns the csv.DictWriter used, so the header is only written once.
+    """
+    if outputFormat == "jsonl":
+        outStream.writelines(json.dumps(record) + "\n" for record in records)
+        return writer
+
+    if writer is None:
+        fieldNames = OUTPUT_COLUMNS
+        if len(records) > 0 and DISPLAY_COLUMN in records[0]:
+            fieldNames = OUTPUT_COLUMNS + [DISPLAY_COLUMN]
+        writer = csv.DictWriter(outStream, fieldnames=fieldNames)
+        writer.writeheader()
+    for record in records:
+        # Recommended IDs are joined with ";" to keep one row per product
+        row = dict(record, RECOMMENDED=";".join(record["RECOMMENDED"]))
+        if DISPLAY_COLUMN in record:
+            row[DISPLAY_COLUMN] = "\n".join(record[DISPLAY_COLUMN])
+        writer.writerow(row)
+    return writer
+
+
+# Function to run the batch recommendation
+def runBatch(
+    model,
+    popularity,
+    idStream,
+    outStream,
+    outputFormat="csv",
+    productIndex=None,
+    catalog=None,
+):
+    """
+    Parameters:
+    model - a CoPurchaseModel.
+    popularity - a Recommendation.PopularityIndex built from the model and prod.csv.
+    idStream - a text stream with one product ID per line.
+    outStream - a text stream to write the recommendations to.
+    outputFormat - a string, "csv" or "jsonl".
+    productIndex - a Recommendation.ProductIndex to add the DISPLAY lines, or None.
+    catalog - a set of the product IDs in prod.csv, other IDs are skipped, or None to answer every ID.
+    Returns a tuple consisting of the number of products answered and the list of skipped product IDs.
+    """
+    writer = None
+    productCount = 0
+    unknownIDs = []
+    for productIDs in readProductIDs(idStream):
+        if catalog is not None:
+            # Only answer products that exist, the same as the interactive program
+            unknownIDs.extend(
+                productID for productID in productIDs if productID not in catalog
+            )
+            productIDs = [productID for productID in productIDs if productID in catalog]
+            if len(productIDs) == 0:
+                continue
+        records = recommendBatch(model, productIDs, popularity, productIndex)
+        writer = writeRecords(records, outStream, outputFormat, writer)
+        productCount += len(productIDs)
+    return productCount, unknownIDs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write recommendations for many product IDs at once."
+    )
+    parser.add_argument("folder", help="folder with prod.csv and purchases.csv")
+    parser.add_argument(
+        "--input", default="-", help="file with one product ID per line (- for stdin)"
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="recommend for every product in prod.csv"
+    )
+    parser.add_argument("--output", default="-", help="output file (- for stdout)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument(
+        "--scoring", choices=Recommendation.SCORING_MODES, default="count"
+    )
+    parser.add_argument(
+        "--display",
+        action="store_true",
+        help="add the display lines of the recommended products",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="processes used to build the co-purchasing model",
+    )
+    args = parser.parse_args()
+
+    # Keep progress messages out of the recommendations written to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        model = Recommendation.getCoPurchaseModel(
+            os.path.join(args.folder, "purchases.csv"),
+            scoring=args.scoring,
+            workers=args.workers,
+        )
+
+    productdf = PurchaseData.readDataFile(os.path.join(args.folder, "prod.csv"))
+    # Convert all product IDs to uppercase for consistency
+    productdf["PRODUCT_ID"] = productdf["PRODUCT_ID"].str.upper()
+    catalog = set(productdf["PRODUCT_ID"])
+    Recommendation.reformatProdData(productdf)
+    popularity = Recommendation.buildPopularityIndex(model, productdf)
+    productIndex = None
+    if args.display:
+        productIndex = Recommendation.buildProductIndex(productdf)
+
+    with contextlib.ExitStack() as stack:
+        if args.all:
+            idStream = (productID + "\n" for productID in sorted(catalog))
+        elif args.input == "-":
+            idStream = sys.stdin
+        else:
+            idStream = stack.enter_context(open(args.input))
+        if args.output == "-":
+            outStream = sys.stdout
+        else:
+            outStream = stack.enter_context(open(args.output, "w", newline=""))
+        productCount, unknownIDs = runBatch(
+            model, popularity, idStream, outStream, args.format, productIndex, catalog
+        )
+    if unknownIDs:
+        print(
+            f"Skipped {len(unknownIDs)} product IDs not in prod.csv:",
+            " ".join(unknownIDs),
+            file=sys.stderr,
+        )
+    print(f"Wrote recommendations for {productCount} products.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,507 @@
+"""
+@author: Linh Vo
+@purpose: This program benchmarks the recommendation engine in Recommendation.py.
+Usage: python RecommendationBenchmark.py scoring --folder pdata
+       python RecommendationBenchmark.py scoring --rows 1000000
+       python RecommendationBenchmark.py approximate --folder pdata --top 10
+       python RecommendationBenchmark.py parallel --rows 10000000 --workers 1 2 4 8
+       python RecommendationBenchmark.py evaluate --rows 10000 1000000 10000000 --output results.json
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import PurchaseData
+import Recommendation
+
+AGE_GROUPS = ["0-17", "18-25", "26-35", "36-45", "46-50", "51-55", "55+"]
+# Largest catalog for which the dense fillProductCoPurchase frame is timed
+DENSE_PRODUCT_LIMIT = 5000
+
+
+# Function to generate a synthetic purchase log
+def generateSyntheticPurchases(
+    rowCount, userCount=None, productCount=None, seed=0, affinity=0.0, groupCount=50
+):
+    """
+    Parameters:
+    rowCount - a single integer, the number of purchase rows.
+    userCount - a single integer, the number of customers, defaults to rowCount // 10.
+    productCount - a single integer, the number of products, defaults to rowCount // 100.
+    seed - a single integer for the random generator.
+    affinity - a float, the share of purchases a customer makes in their own product group.
+    groupCount - a single integer, the number of product groups used with affinity.
+    Returns a data frame with the USER_ID, PRODUCT_ID, AGE and PURCHASE columns of purchases.csv.
+    Product popularity follows a Zipf-like curve so a few products dominate, as in real logs.
+    With affinity, products of a same group are bought together, which gives the
+    co-purchase model something to find in offline evaluation.
+    """
+    rng = np.random.default_rng(seed)
+    userCount = userCount or max(rowCount // 10, 1)
+    productCount = productCount or max(rowCount // 100, 2)
+    popularity = 1.0 / np.arange(1, productCount + 1) ** 0.8
+    userCodes = rng.integers(0, userCount, size=rowCount)
+    productCodes = rng.choice(
+        productCount, size=rowCount, p=popularity / popularity.sum()
+    )
+    if affinity > 0:
+        # Move some purchases to the product of the same rank in the customer's group
+        userGroups = rng.integers(0, groupCount, size=userCount)[userCodes]
+        inGroup = rng.random(rowCount) < affinity
+        groupCodes = productCodes // groupCount * groupCount + userGroups
+        productCodes = np.where(
+            inGroup & (groupCodes < productCount), groupCodes, productCodes
+        )
+    return pd.DataFrame(
+        {
+            "USER_ID": 1000000 + userCodes,
+            "PRODUCT_ID": pd.Categorical.from_codes(
+                productCodes, [f"P{code:08d}" for code in range(productCount)]
+            ),
+            # Each customer keeps one age group
+            "AGE": pd.Categorical.from_codes(userCodes % len(AGE_GROUPS), AGE_GROUPS),
+            "PURCHASE": rng.integers(200, 24000, size=rowCount),
+        }
+    )
+
+
+# Function to load the sparse purchase summary to benchmark on
+def loadPeopleProducts(folderName=None, rowCount=None):
+    """
+    Parameters:
+    folderName - a string for the folder with purchases.csv, or None to use synthetic data.
+    rowCount - a single integer, the number of synthetic purchase rows.
+    Returns a tuple consisting of the sparse purchase matrix, the user IDs and the product IDs.
+    """
+    if folderName is not None:
+        summary = PurchaseData.streamPurchaseSummary(
+            os.path.join(folderName, "purchases.csv")
+        )
+        return Recommendation.buildPeopleProductsMatrixFromCodes(
+            summary.encoding,
+            summary.userCodes,
+            summary.productCodes,
+            summary.purchaseCounts,
+        )
+    return Recommendation.buildPeopleProductsMatrix(
+        generateSyntheticPurchases(rowCount)
+    )
+
+
+# Function to time a call and record its peak memory
+def measure(function, *args):
+    """
+    Parameters:
+    function - the function to call.
+    args - the arguments to pass to function.
+    Returns a tuple consisting of the result, the run time in seconds and the peak traced memory in megabytes.
+    """
+    tracemalloc.start()
+    startTime = time.perf_counter()
+    result = function(*args)
+    runTime = time.perf_counter() - startTime
+    peakMemory = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    tracemalloc.stop()
+    return result, runTime, peakMemory
+
+
+# Function to time a stage and measure its peak memory in a separate traced run
+def measureStage(function, *args):
+    """
+    Parameters:
+    function - the function to call.
+    args - the arguments to pass to function.
+    Returns a tuple consisting of the result and a dictionary with the untraced run time in seconds
+    and the peak traced memory in megabytes.
+    Memory tracing slows down Python code a lot, so the stage runs twice.
+    """
+    startTime = time.perf_counter()
+    result = function(*args)
+    runTime = time.perf_counter() - startTime
+    del result
+    result, _, peakMemory = measure(function, *args)
+    return result, {"seconds": runTime, "peakMB": peakMemory}
+
+
+# Function to compare build time and memory of the scoring modes
+def benchmarkScoringModes(peopleProductsMatrix, productIDs):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse matrix with the purchase count of each product by each customer.
+    productIDs - an array of product IDs matching the columns of peopleProductsMatrix.
+    Returns a data frame with one row of measurements per scoring mode.
+    """
+    results = []
+    for scoring in Recommendation.SCORING_MODES:
+        similarity, buildTime, buildMemory = measure(
+            Recommendation.buildSimilarityMatrix, peopleProductsMatrix, scoring
+        )
+        neighborIndex, indexTime, indexMemory = measure(
+            Recommendation.buildNeighborIndex, similarity, productIDs
+        )
+        results.append(
+            {
+                "SCORING": scoring,
+                "BUILD_S": round(buildTime, 4),
+                "BUILD_PEAK_MB": round(buildMemory, 2),
+                "INDEX_S": round(indexTime, 4),
+                "INDEX_PEAK_MB": round(indexMemory, 2),
+                "PAIRS": similarity.nnz,
+                "MATRIX_MB": round(
+                    (
+                        similarity.data.nbytes
+                        + similarity.indices.nbytes
+                        + similarity.indptr.nbytes
+                    )
+                    / (1024 * 1024),
+                    2,
+                ),
+            }
+        )
+    return pd.DataFrame(results)
+
+
+# Function to measure how many exact top neighbors the MinHash index finds
+def benchmarkApproximate(peopleProductsMatrix, productIDs, topK=10, errorBounds=None):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse matrix with the purchase count of each product by each customer.
+    productIDs - an array of product IDs matching the columns of peopleProductsMatrix.
+    topK - a single integer, the number of neighbors compared per product.
+    errorBounds - a list of Jaccard error bounds to build MinHash indexes for.
+    Returns a data frame with one row of measurements for the exact index and each error bound.
+    """
+    errorBounds = errorBounds or [0.2, 0.1, 0.05]
+    coPurchase, exactTime, exactMemory = measure(
+        Recommendation.buildCoPurchaseMatrix, peopleProductsMatrix
+    )
+    neighborIndex, indexTime, indexMemory = measure(
+        Recommendation.buildNeighborIndex, coPurchase, productIDs, topK
+    )
+    # Exact top neighbors are the first topK entries of each row, best first
+    exactNeighbors = [
+        neighborIndex.neighbors[start : min(end, start + topK)]
+        for start, end in zip(neighborIndex.indptr[:-1], neighborIndex.indptr[1:])
+    ]
+    results = [
+        {
+            "INDEX": "exact",
+            "HASHES": 0,
+            "BUILD_S": round(exactTime + indexTime, 4),
+            "BUILD_PEAK_MB": round(max(exactMemory, indexMemory), 2),
+            "INDEX_MB": round(
+                (coPurchase.data.nbytes + coPurchase.indices.nbytes) / (1024 * 1024), 2
+            ),
+            "QUERY_MS": np.nan,
+            f"RECALL@{topK}": 1.0,
+        }
+    ]
+    for errorBound in errorBounds:
+        minHashIndex, buildTime, buildMemory = measure(
+            Recommendation.buildMinHashIndex,
+            peopleProductsMatrix,
+            productIDs,
+            errorBound,
+        )
+        found = expected = 0
+        startTime = time.perf_counter()
+        for position, exact in enumerate(exactNeighbors):
+            if len(exact) == 0:
+                continue
+            estimates = Recommendation.estimateCoPurchase(minHashIndex, position)
+            approximate = np.argpartition(-estimates, len(exact) - 1)[: len(exact)]
+            found += len(np.intersect1d(approximate, exact))
+            expected += len(exact)
+        queryTime = time.perf_counter() - startTime
+        results.append(
+            {
+                "INDEX": f"minhash e={errorBound}",
+                "HASHES": minHashIndex.signatures.shape[1],
+                "BUILD_S": round(buildTime, 4),
+                "BUILD_PEAK_MB": round(buildMemory, 2),
+                "INDEX_MB": round(
+                    (
+                        minHashIndex.signatures.nbytes
+                        + minHashIndex.sortedSignatures.nbytes
+                        + minHashIndex.sortedProducts.nbytes
+                    )
+                    / (1024 * 1024),
+                    2,
+                ),
+                "QUERY_MS": round(1000 * queryTime / max(len(exactNeighbors), 1), 3),
+                f"RECALL@{topK}": round(found / max(expected, 1), 4),
+            }
+        )
+    return pd.DataFrame(results)
+
+
+# Function to compare the co-purchase build time across numbers of worker processes
+def benchmarkParallelBuild(peopleProductsMatrix, workerCounts):
+    """
+    Parameters:
+    peopleProductsMatrix - a sparse matrix with the purchase count of each product by each customer.
+    workerCounts - a list of numbers of worker processes to try.
+    Returns a data frame with one row of measurements per number of workers.
+    Every parallel result is checked to be identical to the single process matrix.
+    """
+    startTime = time.perf_counter()
+    expected = Recommendation.buildCoPurchaseMatrix(peopleProductsMatrix)
+    baseTime = time.perf_counter() - startTime
+    results = []
+    for workers in workerCounts:
+        startTime = time.perf_counter()
+        coPurchase = Recommendation.buildCoPurchaseMatrix(peopleProductsMatrix, workers)
+        buildTime = time.perf_counter() - startTime
+        results.append(
+            {
+                "WORKERS": workers,
+                "BUILD_S": round(buildTime, 3),
+                "SPEEDUP": round(baseTime / buildTime, 2),
+                "IDENTICAL": coPurchase.shape == expected.shape
+                and (coPurchase != expected).nnz == 0,
+            }
+        )
+    return pd.DataFrame(results)
+
+
+# Function to split off the last purchase of every customer for evaluation
+def splitHeldOut(purchasedf):
+    """
+    Parameters:
+    purchasedf - a data frame storing the purchasing data, in purchase order.
+    Returns a tuple consisting of the training data frame, without the held-out rows,
+    and a data frame with the QUERY product (the purchase before the last) and the
+    HELD_OUT product (the last purchase) of every customer with two purchases or more.
+    """
+    byUser = purchasedf.groupby("USER_ID", observed=True)
+    fromEnd = byUser.cumcount(ascending=False).to_numpy()
+    repeatBuyer = byUser["USER_ID"].transform("size").to_numpy() >= 2
+    evaluation = pd.merge(
+        purchasedf.loc[fromEnd == 1, ["USER_ID", "PRODUCT_ID"]],
+        purchasedf.loc[(fromEnd == 0) & repeatBuyer, ["USER_ID", "PRODUCT_ID"]],
+        on="USER_ID",
+        suffixes=("_QUERY", "_HELD_OUT"),
+    )
+    evaluation.columns = ["USER_ID", "QUERY", "HELD_OUT"]
+    return purchasedf[(fromEnd > 0) | ~repeatBuyer], evaluation
+
+
+# Function to compute how often the held-out purchase is among the top K recommendations
+def hitRateAtK(model, evaluation, topK):
+    """
+    Parameters:
+    model - a CoPurchaseModel built from the training purchases.
+    evaluation - a data frame with the QUERY and HELD_OUT product IDs, as returned by splitHeldOut.
+    topK - a single integer, the number of recommendations checked.
+    Returns a tuple consisting of the hit rate of the co-purchase recommendations, falling back
+    to the most bought products when there is no co-purchase, and the hit rate of the most bought products alone.
+    """
+    neighborIndex = model.neighborIndex
+    queryCodes = PurchaseData.encodeIDs(
+        neighborIndex.productIDs, evaluation["QUERY"].to_numpy()
+    )
+    heldOutCodes = PurchaseData.encodeIDs(
+        neighborIndex.productIDs, evaluation["HELD_OUT"].to_numpy()
+    )
+    popularCodes = np.argsort(-model.totalPurchase, kind="stable")[:topK]
+
+    # First topK neighbors of every product, padded with -2 where a row is shorter
+    positions = neighborIndex.indptr[:-1, None] + np.arange(topK)
+    topNeighbors = np.full(positions.shape, -2, dtype=np.int64)
+    stored = positions < neighborIndex.indptr[1:, None]
+    topNeighbors[stored] = neighborIndex.neighbors[positions[stored]]
+    recommended = np.where(
+        (queryCodes >= 0)[:, None], topNeighbors[np.maximum(queryCodes, 0)], -2
+    )
+    # Products without co-purchases get the most bought products instead
+    noNeighbors = (recommended == -2).all(axis=1)
+    popularHits = np.isin(heldOutCodes, popularCodes) & (heldOutCodes >= 0)
+    hits = np.where(
+        noNeighbors,
+        popularHits,
+        (recommended == heldOutCodes[:, None]).any(axis=1) & (heldOutCodes >= 0),
+    )
+    evaluatedCount = max(len(evaluation), 1)
+    return hits.sum() / evaluatedCount, popularHits.sum() / evaluatedCount
+
+
+# Function to time every stage of the recommendation engine on one synthetic log
+def evaluateScale(rowCount, topK=10, seed=0):
+    """
+    Parameters:
+    rowCount - a single integer, the number of synthetic purchase rows.
+    topK - a single integer, the number of recommendations checked for the hit rate.
+    seed - a single integer for the random generator.
+    Returns a dictionary with the data size, the time and peak traced memory of every stage,
+    and the hit rates at topK on held-out purchases.
+    """
+    purchasedf = generateSyntheticPurchases(rowCount, seed=seed, affinity=0.7)
+    trainingdf, evaluation = splitHeldOut(purchasedf)
+    stages = {}
+
+    with tempfile.TemporaryDirectory() as folderName:
+        purchasePath = os.path.join(folderName, "purchases.csv")
+        trainingdf.to_csv(purchasePath, index=False)
+        # Stream the training file into the sparse purchase summary
+        summary, stages["load"] = measureStage(
+            PurchaseData.streamPurchaseSummary, purchasePath
+        )
+
+    peopleProducts, stages["fillPeopleProducts"] = measureStage(
+        Recommendation.fillPeopleProducts, trainingdf
+    )
+    productCount = peopleProducts.shape[1]
+    del peopleProducts
+    # The dense product x product frame is only affordable for small catalogs
+    stages["fillProductCoPurchase"] = None
+    if productCount <= DENSE_PRODUCT_LIMIT:
+        result, stages["fillProductCoPurchase"] = measureStage(
+            Recommendation.fillProductCoPurchase, trainingdf
+        )
+        del result
+
+    model, stages["buildCoPurchaseModel"] = measureStage(
+        Recommendation.buildCoPurchaseModelFromMatrix,
+        *Recommendation.buildPeopleProductsMatrixFromCodes(
+            summary.encoding,
+            summary.userCodes,
+            summary.productCodes,
+            summary.purchaseCounts,
+        ),
+        topK,
+    )
+
+    queryIDs = evaluation["QUERY"].to_list()
+    result, stages["query"] = measureStage(
+        Recommendation.findRecProdIDsBatch, model.neighborIndex, queryIDs
+    )
+    stages["query"]["queries"] = len(queryIDs)
+    stages["query"]["microsecondsPerQuery"] = (
+        1e6 * stages["query"]["seconds"] / max(len(queryIDs), 1)
+    )
+
+    hitRate, popularHitRate = hitRateAtK(model, evaluation, topK)
+    return {
+        "rows": rowCount,
+        "customers": len(model.userIDs),
+        "products": len(model.productIDs),
+        "customerProductPairs": int(model.peopleProductsMatrix.nnz),
+        "heldOut": len(evaluation),
+        "stages": stages,
+        f"hitRate@{topK}": float(hitRate),
+        f"popularHitRate@{topK}": float(popularHitRate),
+        "processPeakMB": PurchaseData.peakMemoryMB(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation engine.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    scoringParser = commands.add_parser(
+        "scoring", help="compare build time and memory of the scoring modes"
+    )
+    scoringParser.add_argument("--folder", help="folder with purchases.csv")
+    scoringParser.add_argument(
+        "--rows", type=int, default=1000000, help="synthetic rows when no folder"
+    )
+    approximateParser = commands.add_parser(
+        "approximate", help="compare the MinHash index against the exact top neighbors"
+    )
+    approximateParser.add_argument("--folder", help="folder with purchases.csv")
+    approximateParser.add_argument(
+        "--rows", type=int, default=1000000, help="synthetic rows when no folder"
+    )
+    approximateParser.add_argument(
+        "--top", type=int, default=10, help="number of neighbors compared"
+    )
+    parallelParser = commands.add_parser(
+        "parallel", help="compare co-purchase build time across worker processes"
+    )
+    parallelParser.add_argument("--folder", help="folder with purchases.csv")
+    parallelParser.add_argument(
+        "--rows", type=int, default=10000000, help="synthetic rows when no folder"
+    )
+    parallelParser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    evaluateParser = commands.add_parser(
+        "evaluate", help="time every stage and measure hit rate on synthetic logs"
+    )
+    evaluateParser.add_argument(
+        "--rows", type=int, nargs="+", default=[10000, 1000000, 10000000]
+    )
+    evaluateParser.add_argument(
+        "--top", type=int, default=10, help="number of recommendations checked"
+    )
+    evaluateParser.add_argument(
+        "--output", default="benchmark-results.json", help="JSON file to write"
+    )
+    args = parser.parse_args()
+
+    if args.command == "evaluate":
+        results = []
+        for rowCount in args.rows:
+            result = evaluateScale(rowCount, args.top)
+            results.append(result)
+            stageTimes = ", ".join(
+                f"{name} {stage['seconds']:.3f}s"
+                for name, stage in result["stages"].items()
+                if stage is not None
+            )
+            print(
+                f"{rowCount} rows: {stageTimes}, "
+                f"hit rate@{args.top} {result[f'hitRate@{args.top}']:.4f} "
+                f"(most bought {result[f'popularHitRate@{args.top}']:.4f})",
+                flush=True,
+            )
+        with open(args.output, "w") as outFile:
+            json.dump(
+                {
+                    "createdAt": datetime.now(timezone.utc).isoformat(),
+                    "topK": args.top,
+                    "results": results,
+                },
+                outFile,
+                indent=2,
+            )
+        print(f"Results written to {args.output}")
+        return
+
+    peopleProductsMatrix, userIDs, productIDs = loadPeopleProducts(
+        args.folder, args.rows
+    )
+    print(
+        f"{peopleProductsMatrix.shape[0]} customers, {peopleProductsMatrix.shape[1]} products, "
+        f"{peopleProductsMatrix.nnz} customer/product pairs\n"
+    )
+    if args.command == "scoring":
+        print(
+            benchmarkScoringModes(peopleProductsMatrix, productIDs).to_string(
+                index=False
+            )
+        )
+
+    elif args.command == "approximate":
+        print(
+            benchmarkApproximate(peopleProductsMatrix, productIDs, args.top).to_string(
+                index=False
+            )
+        )
+
+    elif args.command == "parallel":
+        print(f"{os.cpu_count()} CPU cores available\n")
+        print(
+            benchmarkParallelBuild(peopleProductsMatrix, args.workers).to_string(
+                index=False
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+@author: Linh Vo
+@purpose: This program sends concurrent requests to the recommendation server and reports p50/p99 latency.
+Usage: python RecommendationLoadTest.py pdata --requests 5000 --concurrency 32
+       python RecommendationLoadTest.py pdata --spawn   (starts RecommendationServer.py itself)
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# Function to send requests over one keep-alive connection
+async def runClient(host, port, productIDs, latencies):
+    """
+    Parameters:
+    host - a string for the server address.
+    port - a single integer for the server port.
+    productIDs - a list of product IDs to ask recommendations for.
+    latencies - a list collecting the latency of every request, in seconds.
+    Returns no value.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    for productID in productIDs:
+        startTime = time.perf_counter()
+        writer.write(
+            f"GET /recommend?product={productID} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode()
+        )
+        await writer.drain()
+        # Read the status line and headers, then the body by its length
+        contentLength = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            if line.lower().startswith(b"content-length:"):
+                contentLength = int(line.split(b":")[1])
+        await reader.readexactly(contentLength)
+        latencies.append(time.perf_counter() - startTime)
+    writer.close()
+    await writer.wait_closed()
+
+
+# Function to run the load test
+async def loadTest(host, port, productIDs, requestCount, concurrency):
+    """
+    Parameters:
+    host - a string for the server address.
+    port - a single integer for the server port.
+    productIDs - a list of product IDs to pick requests from.
+    requestCount - a single integer, the total number of requests.
+    concurrency - a single integer, the number of concurrent connections.
+    Returns a tuple consisting of the array of latencies in seconds and the total run time.
+    """
+    # Spread random products over the clients
+    rng = np.random.default_rng(0)
+    requested = rng.choice(productIDs, size=requestCount)
+    latencies = []
+    startTime = time.perf_counter()
+    await asyncio.gather(
+        *[
+            runClient(host, port, list(requested[i::concurrency]), latencies)
+            for i in range(concurrency)
+        ]
+    )
+    return np.array(latencies), time.perf_counter() - startTime
+
+
+# Function to wait until the server accepts connections
+async def waitForServer(host, port, timeout=60):
+    """
+    Parameters:
+    host - a string for the server address.
+    port - a single integer for the server port.
+    timeout - a single number, the number of seconds to wait.
+    Returns no value.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the recommendation server.")
+    parser.add_argument("folder", help="folder with prod.csv, used to pick product IDs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--spawn",
+        action="store_true",
+        help="start RecommendationServer.py for the test",
+    )
+    args = parser.parse_args()
+
+    productdf = pd.read_csv(os.path.join(args.folder, "prod.csv"))
+    productIDs = productdf["PRODUCT_ID"].str.upper().to_list()
+
+    server = None
+    if args.spawn:
+        serverScript = os.path.join(
+            os.path.dirname(__file__), "RecommendationServer.py"
+        )
+        server = subprocess.Popen(
+            [sys.executable, serverScript, args.folder, "--port", str(args.port)],
+            stdout=subprocess.DEVNULL,
+        )
+    try:
+        asyncio.run(waitForServer(args.host, args.port))
+        latencies, totalTime = asyncio.run(
+            loadTest(args.host, args.port, productIDs, args.requests, args.concurrency)
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print(f"Requests:    {len(latencies)} with {args.concurrency} connections")
+    print(f"Throughput:  {len(latencies) / totalTime:.0f} requests/s")
+    print(f"Latency p50: {p50:.2f} ms")
+    print(f"Latency p99: {p99:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+@author: Linh Vo
+@purpose: This program serves product recommendations as JSON over HTTP, keeping the co-purchasing model in memory.
+Usage: python RecommendationServer.py pdata --port 8080
+       curl "http://127.0.0.1:8080/recommend?product=P00255842"
+       curl "http://127.0.0.1:8080/basket?products=P00255842,P00124642&top=5&aggregate=max"
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import traceback
+from urllib.parse import parse_qs, urlsplit
+
+import PurchaseData
+import Recommendation
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+# Largest request head accepted before the connection is dropped
+MAX_HEADER_LINES = 100
+# Largest request body skipped to keep a connection alive, bodies are never used
+MAX_BODY_BYTES = 1 << 20
+
+
+# Function to load everything the server keeps in memory
+def loadRecommender(folderName, scoring="count", workers=1):
+    """
+    Parameters:
+    folderName - a string for the folder with prod.csv and purchases.csv.
+    scoring - a string, one of Recommendation.SCORING_MODES, used to rank recommendations.
+    workers - a single integer, the number of processes used when the model is built.
+    Returns a dictionary with the co-purchasing model, the similarity matrix used to rank baskets,
+    the product display index and the popularity index.
+    """
+    productdf = PurchaseData.readDataFile(os.path.join(folderName, "prod.csv"))
+    # Convert all product IDs to uppercase for consistency
+    productdf["PRODUCT_ID"] = productdf["PRODUCT_ID"].str.upper()
+    Recommendation.reformatProdData(productdf)
+    model = Recommendation.getCoPurchaseModel(
+        os.path.join(folderName, "purchases.csv"), scoring=scoring, workers=workers
+    )
+    return {
+        "model": model,
+        # Baskets are ranked with the same scoring mode as single products
+        "similarity": Recommendation.buildSimilarityMatrix(
+            model.peopleProductsMatrix, model.scoring, coPurchase=model.coPurchase
+        ),
+        "productIndex": Recommendation.buildProductIndex(productdf),
+        "popularity": Recommendation.buildPopularityIndex(model, productdf),
+    }
+
+
+# Function to create the recommendation for one product
+def recommendProduct(recommender, productID):
+    """
+    Parameters:
+    recommender - the dictionary returned by loadRecommender.
+    productID - a string for purchased product ID.
+    Returns a dictionary ready to be sent as JSON.
+    """
+    likelyToBuyList, maxCoPurchaseScore = Recommendation.findRecProdIDs(
+        recommender["model"].neighborIndex, productID
+    )
+    if maxCoPurchaseScore == 0:
+        # Recommend most popular products in the same category
+        recProductList = Recommendation.findPopularProdIDs(
+            recommender["popularity"], productID
+        )
+        recommendType = "popular"
+    else:
+        # Recommend most likely to buy together products
+        recProductList = likelyToBuyList
+        recommendType = "co-purchase"
+    return {
+        "product": productID,
+        "score": maxCoPurchaseScore,
+        "type": recommendType,
+        "recommended": recProductList,
+        "display": Recommendation.formatRecProducts(
+            recommender["productIndex"], recProductList
+        ),
+    }
+
+
+# Function to create the recommendation for a basket of products
+def recommendBasket(recommender, basketProds, topK, aggregate):
+    """
+    Parameters:
+    recommender - the dictionary returned by loadRecommender.
+    basketProds - a list of strings for the product IDs in the basket.
+    topK - a single integer, the number of products to recommend.
+    aggregate - a string, one of Recommendation.BASKET_AGGREGATES.
+    Returns a dictionary ready to be sent as JSON.
+    """
+    model = recommender["model"]
+    recProductList, scores = Recommendation.findBasketRecProdIDs(
+        recommender["similarity"], model.productIDs, basketProds, topK, aggregate
+    )
+    return {
+        "basket": basketProds,
+        "aggregate": aggregate,
+        "recommended": recProductList,
+        "scores": scores,
+        # Display lines follow the rank of the recommendations
+        "display": Recommendation.formatRecProducts(
+            recommender["productIndex"], recProductList, ranked=True
+        ),
+    }
+
+
+# Function to answer one HTTP request
+def route(recommender, method, target):
+    """
+    Parameters:
+    recommender - the dictionary returned by loadRecommender.
+    method - a string for the HTTP method.
+    target - a string for the request target, such as "/recommend?product=ID" or "/basket?products=ID,ID".
+    Returns a tuple consisting of the HTTP status code and the JSON-serializable body.
+    """
+    if method != "GET":
+        return 405, {"error": "only GET is supported"}
+    url = urlsplit(target)
+    if url.path == "/health":
+        return 200, {"status": "ok"}
+    query = parse_qs(url.query)
+    if url.path == "/basket":
+        basketProds = [
+            productID.strip().upper()
+            for productID in query.get("products", [""])[0].split(",")
+            if productID.strip() != ""
+        ]
+        aggregate = query.get("aggregate", ["sum"])[0]
+        topK = query.get("top", [str(Recommendation.TOP_NEIGHBORS)])[0]
+        if len(basketProds) == 0:
+            return 400, {"error": "missing products parameter"}
+        if len(basketProds) > Recommendation.MAX_BASKET_SIZE:
+            return 400, {
+                "error": f"at most {Recommendation.MAX_BASKET_SIZE} products per basket"
+            }
+        if aggregate not in Recommendation.BASKET_AGGREGATES:
+            return 400, {"error": "unknown aggregate " + aggregate}
+        try:
+            topK = int(topK)
+        except ValueError:
+            topK = 0
+        if topK <= 0:
+            return 400, {"error": "top must be a positive integer"}
+        return 200, recommendBasket(recommender, basketProds, topK, aggregate)
+    if url.path != "/recommend":
+        return 404, {"error": "unknown path " + url.path}
+
+    productID = query.get("product", [""])[0].strip().upper()
+    if productID == "":
+        return 400, {"error": "missing product parameter"}
+    # Only products in prod.csv are answered, the same as the interactive program
+    if productID not in recommender["productIndex"].productIDs:
+        return 404, {"error": "unknown product " + productID}
+    return 200, recommendProduct(recommender, productID)
+
+
+# Function to serve the requests of one client connection
+async def handleConnection(recommender, reader, writer):
+    """
+    Parameters:
+    recommender - the dictionary returned by loadRecommender.
+    reader - the asyncio StreamReader of the connection.
+    writer - the asyncio StreamWriter of the connection.
+    Returns no value.
+    Connections are kept alive so a client can send many requests without reconnecting.
+    """
+    try:
+        while True:
+            try:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                parts = requestLine.decode("latin-1").split()
+                # Read the headers, only Connection and the body length matter here
+                headers = {}
+                for _ in range(MAX_HEADER_LINES):
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip().lower()
+
+                if len(parts) != 3:
+                    status, body = 400, {"error": "malformed request line"}
+                    keepAlive = False
+                else:
+                    method, target, version = parts
+                    status, body = route(recommender, method, target)
+                    keepAlive = headers.get("connection", "") != "close" and (
+                        version == "HTTP/1.1"
+                        or headers.get("connection") == "keep-alive"
+                    )
+                    # Skip the body so the next request starts at the right place,
+                    # a body that cannot be skipped safely closes the connection
+                    try:
+                        bodyLength = int(headers.get("content-length", "0"))
+                    except ValueError:
+                        bodyLength = -1
+                    if (
+                        "transfer-encoding" in headers
+                        or not 0 <= bodyLength <= MAX_BODY_BYTES
+                    ):
+                        keepAlive = False
+                    elif bodyLength > 0:
+                        await reader.readexactly(bodyLength)
+            except ConnectionError:
+                raise
+            except Exception:
+                # Answer any other failure, such as a line over the length limit,
+                # then close since the rest of the request may not have been read
+                traceback.print_exc()
+                status, body = 500, {"error": "internal server error"}
+                keepAlive = False
+
+            payload = json.dumps(body).encode()
+            writer.write(
+                (
+                    f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keepAlive else 'close'}\r\n\r\n"
+                ).encode()
+                + payload
+            )
+            await writer.drain()
+            if not keepAlive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+# Function to start the server and run it until interrupted
+async def serve(recommender, host, port):
+    """
+    Parameters:
+    recommender - the dictionary returned by loadRecommender.
+    host - a string for the address to listen on.
+    port - a single integer for the port to listen on.
+    Returns no value.
+    """
+    server = await asyncio.start_server(
+        lambda reader, writer: handleConnection(recommender, reader, writer),
+        host,
+        port,
+    )
+    print(
+        f"Serving recommendations on http://{host}:{port}/recommend?product=<id>",
+        flush=True,
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve product recommendations.")
+    parser.add_argument("folder", help="folder with prod.csv and purchases.csv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--scoring", choices=Recommendation.SCORING_MODES, default="count"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="processes used to build the co-purchasing model",
+    )
+    args = parser.parse_args()
+
+    recommender = loadRecommender(args.folder, args.scoring, args.workers)
+    try:
+        asyncio.run(serve(recommender, args.host, args.port))
+    except KeyboardInterrupt:
+        print("Bye!")
+
+
+if __name__ == "__main__":
+    main()
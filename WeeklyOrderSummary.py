@@ -3,11 +3,13 @@
 @purpose: This program composes and displays a summary of the purchase data from the past week for a coffee shop then provides answers for questions regarding peak for each day of the week.
 """
 
+import csv
 import datetime
+import json
+import sys
 import orderlog
 
-ORDERS = orderlog.orderlst
-ORDERS.pop(0)  # Remove column header of order list
+ORDERS = orderlog.orderlst[1:]  # Skip column header of order list, leaving orderlog untouched
 
 DAYS_OF_WEEK = [
     "Monday",
@@ -22,6 +24,11 @@ DAYS_OF_WEEK = [
 OPEN_TIME = 6 * 60
 CLOSE_TIME = 22 * 60
 
+OUTPUT_FORMATS = ["text", "csv", "json"]
+
+# Time strings of every minute of the day, shared by all interval labels
+TIME_STRINGS = [f"{minute // 60}:{minute % 60:02d}" for minute in range(24 * 60)]
+
 
 # Function to convert time string to minutes
 
@@ -63,6 +70,31 @@ def labelString(intervalIndex, openingTime, intervalLength):
     return timeString
 
 
+# Function to produce the string labels of all intervals at once
+
+
+def labelStrings(intervalCount, openingTime, intervalLength):
+    """
+    Parameters:
+    intervalCount - a single integer, the number of intervals.
+    openingTime - a single integer, constant defined as OPEN_TIME.
+    intervalLength - a single integer, in minutes.
+    Returns a list of strings, the same as labelString gives for each interval index.
+    """
+
+    lastTime = openingTime + intervalLength * intervalCount
+    timeStrings = TIME_STRINGS
+    # Intervals ending after midnight keep counting hours, as labelString does
+    if lastTime > len(timeStrings):
+        timeStrings = timeStrings + [
+            f"{minute // 60}:{minute % 60:02d}" for minute in range(len(timeStrings), lastTime)
+        ]
+    return [
+        timeStrings[startTime] + "-" + timeStrings[startTime + intervalLength - 1]
+        for startTime in range(openingTime, lastTime, intervalLength)
+    ]
+
+
 # Function to create the order summary matrix
 
 
@@ -92,6 +124,51 @@ def composeWeeklyOrdersMatrix(intervalLength=60):
     return matrix
 
 
+# Function to write the order summary to a stream
+
+
+def renderOrderSummary(orderMatrix, intervalLength, outStream=None, outputFormat="text"):
+    """
+    Parameters:
+    orderMatrix - a two-dimensional list of integers.
+    intervalLength - a single integer, in minutes.
+    outStream - a text stream to write to, None for the standard output.
+    outputFormat - a string, one of OUTPUT_FORMATS: "text" for the fixed-width display,
+    "csv" for one row per day, or "json" for the interval labels and the orders of each day.
+    Returns no value.
+    """
+
+    if outputFormat not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {outputFormat!r}, expected one of {OUTPUT_FORMATS}")
+    if outStream is None:
+        outStream = sys.stdout
+    intervalCount = (CLOSE_TIME - OPEN_TIME) // intervalLength
+    labels = labelStrings(intervalCount, OPEN_TIME, intervalLength)
+
+    if outputFormat == "csv":
+        writer = csv.writer(outStream)
+        writer.writerow(["DAY"] + labels)
+        for x in range(len(DAYS_OF_WEEK)):
+            writer.writerow([DAYS_OF_WEEK[x]] + orderMatrix[x])
+    elif outputFormat == "json":
+        summary = {
+            "intervalLength": intervalLength,
+            "intervals": labels,
+            "orders": dict(zip(DAYS_OF_WEEK, orderMatrix)),
+        }
+        outStream.write(json.dumps(summary) + "\n")
+    else:
+        # Build each line with one format call, every cell padded to the width of its column
+        header = "DAY\\TIME".ljust(9) + "|" + ("{:>11}|" * intervalCount).format(*labels)
+        rowFormat = "{:<9}" + "{:>12}" * intervalCount
+        dashes = "-" * len(header)
+        lines = ["", "WEEKLY ORDER SUMMARY", "", header, dashes]
+        for x in range(len(DAYS_OF_WEEK)):
+            lines.append(rowFormat.format(DAYS_OF_WEEK[x], *orderMatrix[x]))
+        lines.append(dashes)
+        outStream.write("\n".join(lines) + "\n")
+
+
 # Function to display the content of the matrix
 
 
@@ -103,25 +180,7 @@ def printOrderSummaryMatrix(orderMatrix, intervalLength):
     Print order summary display.
     """
 
-    # Create string for all time intervals
-    timeIntervals = ""
-    intervalCount = (CLOSE_TIME - OPEN_TIME) // intervalLength
-    for i in range(intervalCount):
-        timeIntervals += labelString(i, OPEN_TIME, intervalLength).rjust(11) + "|"
-
-    # Summary length to use for displaying dashes
-    stringLength = len("DAY\\TIME".ljust(9) + "|" + timeIntervals)
-
-    print("\nWEEKLY ORDER SUMMARY\n")
-    print("DAY\\TIME".ljust(9) + "|" + timeIntervals)  # Column header
-    print("-" * stringLength)
-    # Format and print order summary matrix
-    for x in range(len(DAYS_OF_WEEK)):
-        orders = ""
-        for order in orderMatrix[x]:
-            orders += str(order).rjust(12)
-        print(DAYS_OF_WEEK[x].ljust(9) + orders)
-    print("-" * stringLength)
+    renderOrderSummary(orderMatrix, intervalLength, sys.stdout, "text")
 
 
 # Main function to start the program flow, read user input, call other functions
@@ -133,9 +192,23 @@ def main():
         intervalInput = input("\nPlease specify the length of the time interval in minutes: ")
 
     intervalInput = eval(intervalInput)
-    # Display order summary
+
+    formatInput = "format"
+    # If user enters an unknown format, ask for input again
+    while formatInput not in OUTPUT_FORMATS and formatInput != "":
+        formatInput = input(f"\nEnter output format {OUTPUT_FORMATS}, or press Enter for text: ").strip().lower()
+    if formatInput == "":
+        formatInput = "text"
+    fileInput = input("\nEnter file name to save the summary, or press Enter to display it: ").strip()
+
+    # Display or save order summary
     orderMatrix = composeWeeklyOrdersMatrix(intervalInput)
-    printOrderSummaryMatrix(orderMatrix, intervalInput)
+    if fileInput == "":
+        renderOrderSummary(orderMatrix, intervalInput, sys.stdout, formatInput)
+    else:
+        with open(fileInput, "w", newline="") as outFile:
+            renderOrderSummary(orderMatrix, intervalInput, outFile, formatInput)
+        print(f"Order summary saved to {fileInput}")
 
     dayInput = "day"
     # If user doesn't press Enter, run this loop body
@@ -164,4 +237,5 @@ def main():
     print("Bye!")
 
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
\ No newline at end of file